@@ -0,0 +1,184 @@
+import boto3
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.credentials import RefreshableCredentials
+from botocore.session import get_session
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Payers to query: comma-separated role ARNs and/or payer account IDs.
+# Plain account IDs are turned into role ARNs using AWS_PAYER_ROLE_NAME.
+# When unset, the static keys from .env are used as a single payer.
+AWS_PAYERS = [p.strip() for p in os.getenv("AWS_PAYERS", "").split(",") if p.strip()]
+AWS_PAYER_ROLE_NAME = os.getenv("AWS_PAYER_ROLE_NAME", "OrganizationAccountAccessRole")
+AWS_PAYER_EXTERNAL_ID = os.getenv("AWS_PAYER_EXTERNAL_ID")
+AWS_ROLE_SESSION_NAME = os.getenv("AWS_ROLE_SESSION_NAME", "grafana-cost-management")
+AWS_PAYER_CONCURRENCY = int(os.getenv("AWS_PAYER_CONCURRENCY", "8"))
+
+# Shared botocore config: a connection pool large enough for concurrent
+# payer queries and adaptive retries so Cost Explorer throttling backs off.
+BOTO_CONFIG = Config(
+    region_name=os.getenv("AWS_DEFAULT_REGION"),
+    max_pool_connections=int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "20")),
+    retries={"mode": "adaptive", "max_attempts": int(os.getenv("AWS_MAX_ATTEMPTS", "10"))},
+)
+
+_lock = threading.Lock()
+_base_session = None
+_sessions = {}
+_clients = {}
+_labels = {}
+
+
+def _get_base_session():
+    global _base_session
+    with _lock:
+        if _base_session is None:
+            _base_session = boto3.Session(
+                aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                region_name=os.getenv("AWS_DEFAULT_REGION"),
+            )
+        return _base_session
+
+
+def get_payers():
+    """Return the payer role ARNs to query, or [None] for the static keys."""
+    payers = []
+    for payer in AWS_PAYERS:
+        if payer.startswith("arn:"):
+            payers.append(payer)
+        else:
+            payers.append(f"arn:aws:iam::{payer}:role/{AWS_PAYER_ROLE_NAME}")
+    return payers or [None]
+
+
+# Build a session whose credentials are refreshed through STS shortly before
+# they expire, so repeated queries reuse the same assumed-role credentials.
+def _assume_role_session(role_arn):
+    sts = _get_base_session().client("sts", config=BOTO_CONFIG)
+
+    def refresh():
+        params = {"RoleArn": role_arn, "RoleSessionName": AWS_ROLE_SESSION_NAME}
+        if AWS_PAYER_EXTERNAL_ID:
+            params["ExternalId"] = AWS_PAYER_EXTERNAL_ID
+        credentials = sts.assume_role(**params)["Credentials"]
+        return {
+            "access_key": credentials["AccessKeyId"],
+            "secret_key": credentials["SecretAccessKey"],
+            "token": credentials["SessionToken"],
+            "expiry_time": credentials["Expiration"].isoformat(),
+        }
+
+    botocore_session = get_session()
+    botocore_session._credentials = RefreshableCredentials.create_from_metadata(
+        metadata=refresh(),
+        refresh_using=refresh,
+        method="sts-assume-role",
+    )
+    return boto3.Session(botocore_session=botocore_session, region_name=os.getenv("AWS_DEFAULT_REGION"))
+
+
+def get_session_for_payer(role_arn=None):
+    if role_arn is None:
+        return _get_base_session()
+    with _lock:
+        session = _sessions.get(role_arn)
+    if session is None:
+        session = _assume_role_session(role_arn)
+        with _lock:
+            session = _sessions.setdefault(role_arn, session)
+    return session
+
+
+def get_client(service_name, role_arn=None):
+    """Return a cached boto3 client for the given payer (None = static keys)."""
+    key = (service_name, role_arn)
+    with _lock:
+        client = _clients.get(key)
+    if client is None:
+        client = get_session_for_payer(role_arn).client(service_name, config=BOTO_CONFIG)
+        with _lock:
+            client = _clients.setdefault(key, client)
+    return client
+
+
+def get_ce_client(role_arn=None):
+    return get_client("ce", role_arn)
+
+
+def payer_label(role_arn=None):
+    """Account ID used in the Payer column of the reports."""
+    if role_arn is not None:
+        return role_arn.split(":")[4]
+    with _lock:
+        label = _labels.get(None)
+    if label is None:
+        label = get_client("sts").get_caller_identity()["Account"]
+        with _lock:
+            _labels[None] = label
+    return label
+
+
+def get_cost_and_usage_results(client, **kwargs):
+    """Call get_cost_and_usage, following NextPageToken, and return all ResultsByTime."""
+    results = []
+    while True:
+        response = client.get_cost_and_usage(**kwargs)
+        results.extend(response["ResultsByTime"])
+        token = response.get("NextPageToken")
+        if not token:
+            return results
+        kwargs["NextPageToken"] = token
+
+
+def hourly_time_period(start, end):
+    """TimePeriod for HOURLY granularity, which needs full ISO timestamps."""
+    return {"Start": start.strftime("%Y-%m-%dT%H:%M:%SZ"), "End": end.strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+
+def collect_from_all_payers(fetch_records):
+    """Run fetch_records(client, payer) for every payer concurrently.
+
+    Returns the CostRecords of all payers, in payer order. A payer that
+    fails is reported and skipped.
+    """
+    payers = get_payers()
+
+    def fetch(role_arn):
+        return list(fetch_records(get_ce_client(role_arn), payer_label(role_arn)))
+
+    records = []
+    with ThreadPoolExecutor(max_workers=max(1, min(AWS_PAYER_CONCURRENCY, len(payers)))) as executor:
+        futures = [(role_arn, executor.submit(fetch, role_arn)) for role_arn in payers]
+        for role_arn, future in futures:
+            try:
+                records.extend(future.result())
+            except Exception as e:
+                print(f"Error while fetching data for payer {role_arn or 'default'}: {e}")
+    return records
+
+
+def collect_series_from_all_payers(fetch_records, store, series_key):
+    """Run fetch_records(client, payer) for every payer concurrently, adding records to an HourlySeriesStore.
+
+    Records are streamed into store as they are parsed instead of being
+    kept. series_key(record) gives the series each record belongs to.
+    """
+    payers = get_payers()
+
+    def fetch(role_arn):
+        for record in fetch_records(get_ce_client(role_arn), payer_label(role_arn)):
+            store.add_record(series_key(record), record)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(AWS_PAYER_CONCURRENCY, len(payers)))) as executor:
+        futures = [(role_arn, executor.submit(fetch, role_arn)) for role_arn in payers]
+        for role_arn, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error while fetching data for payer {role_arn or 'default'}: {e}")
+    return store
@@ -1,43 +1,64 @@
-import boto3
-import csv
 import os
+import sys
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from aws_clients import (
+    collect_from_all_payers,
+    collect_series_from_all_payers,
+    get_cost_and_usage_results,
+    hourly_time_period,
+)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from cost_record import CostRecord, write_records_csv
+from hourly_series import HourlySeriesStore, cost_granularity, hourly_mode, hourly_window
 
 load_dotenv()
 
 def get_aws_cost_per_account():
-    client = boto3.client(
-        "ce",
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region_name=os.getenv("AWS_DEFAULT_REGION"),
-    )
+    if hourly_mode():
+        start, end = hourly_window()
+        time_period = hourly_time_period(start, end)
+    else:
+        end_date = datetime.utcnow().date()
+        start_date = end_date - timedelta(days=7)
+        time_period = {"Start": str(start_date), "End": str(end_date)}
 
-    end_date = datetime.utcnow().date()
-    start_date = end_date - timedelta(days=7)
+    def fetch_records(client, payer):
+        results = get_cost_and_usage_results(
+            client,
+            TimePeriod=time_period,
+            Granularity=cost_granularity(),
+            Metrics=["UnblendedCost"],
+            GroupBy=[{"Type": "DIMENSION", "Key": "LINKED_ACCOUNT"}],
+        )
 
-    response = client.get_cost_and_usage(
-        TimePeriod={"Start": str(start_date), "End": str(end_date)},
-        Granularity="DAILY",
-        Metrics=["UnblendedCost"],
-        GroupBy=[{"Type": "DIMENSION", "Key": "LINKED_ACCOUNT"}],
-    )
+        for result in results:
+            date = result["TimePeriod"]["Start"]
+            for group in result["Groups"]:
+                account = group["Keys"][0]
+                cost = group["Metrics"]["UnblendedCost"]["Amount"]
+                yield CostRecord("aws", account, "", date, cost, payer=payer)
 
-    rows = [["Account", "Date", "Cost"]]
-    for result in response["ResultsByTime"]:
-        date = result["TimePeriod"]["Start"]
-        for group in result["Groups"]:
-            account = group["Keys"][0]
-            cost = group["Metrics"]["UnblendedCost"]["Amount"]
-            rows.append([account, date, cost])
+    if hourly_mode():
+        store = collect_series_from_all_payers(
+            fetch_records,
+            HourlySeriesStore(start, end),
+            lambda record: (record.payer, record.account),
+        )
+        return store.write_csv(
+            "aws-cost-per-account-hourly.csv",
+            ["Payer", "Account", "Hour", "Cost"],
+            lambda key, hour, cost: [key[0], key[1], hour, cost],
+        )
 
-    filename = "aws-cost-per-account.csv"
-    with open(filename, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerows(rows)
-
-    return filename
+    records = collect_from_all_payers(fetch_records)
+    return write_records_csv(
+        "aws-cost-per-account.csv",
+        ["Payer", "Account", "Date", "Cost"],
+        records,
+        lambda record: [record.payer, record.account, record.date, record.amount],
+    )
 
 if __name__ == "__main__":
     print("Fetching AWS Cost per Account...")
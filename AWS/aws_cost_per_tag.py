@@ -0,0 +1,54 @@
+import os
+import sys
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from aws_clients import collect_from_all_payers, get_cost_and_usage_results
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from cost_record import CostRecord, write_records_csv
+from tag_index import update_tag_index
+
+load_dotenv()
+
+# Cost allocation tag keys to collect, e.g. "team,project,cost-center"
+COST_ALLOCATION_TAG_KEYS = [k.strip() for k in os.getenv("COST_ALLOCATION_TAG_KEYS", "").split(",") if k.strip()]
+
+def get_aws_cost_per_tag():
+    end_date = datetime.utcnow().date()
+    start_date = end_date - timedelta(days=7)
+
+    def fetch_records(client, payer):
+        for tag_key in COST_ALLOCATION_TAG_KEYS:
+            results = get_cost_and_usage_results(
+                client,
+                TimePeriod={"Start": str(start_date), "End": str(end_date)},
+                Granularity="DAILY",
+                Metrics=["UnblendedCost"],
+                GroupBy=[
+                    {"Type": "DIMENSION", "Key": "LINKED_ACCOUNT"},
+                    {"Type": "TAG", "Key": tag_key},
+                ],
+            )
+
+            for result in results:
+                date = result["TimePeriod"]["Start"]
+                for group in result["Groups"]:
+                    account = group["Keys"][0]
+                    # Tag groups come back as "key$value"; untagged cost has an empty value
+                    tag_value = group["Keys"][1].partition("$")[2]
+                    cost = group["Metrics"]["UnblendedCost"]["Amount"]
+                    yield CostRecord("aws", account, "", date, cost, payer=payer, extra=[tag_key, tag_value])
+
+    records = collect_from_all_payers(fetch_records)
+    update_tag_index(records)
+    return write_records_csv(
+        "aws-cost-per-tag.csv",
+        ["Payer", "Account", "TagKey", "TagValue", "Date", "Cost"],
+        records,
+        lambda record: [record.payer, record.account, record.extra[0], record.extra[1], record.date, record.amount],
+    )
+
+if __name__ == "__main__":
+    print("Fetching AWS Cost per Cost Allocation Tag...")
+    file_path = get_aws_cost_per_tag()
+    print(f"File saved: {file_path}")
@@ -0,0 +1,195 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+from dotenv import load_dotenv
+from aws_gpu_cost_report import INSTANCE_TYPES_WITH_GPU
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from cost_record import CostRecord, write_records_csv
+from rollup_cubes import update_rollups
+
+load_dotenv()
+
+# CUR 2.0 Parquet export: a local directory or s3://bucket/prefix
+CUR_PATH = os.getenv("CUR_PATH", "cur")
+# Endpoint of an S3-compatible stand-in (e.g. MinIO); unset for AWS S3
+CUR_S3_ENDPOINT = os.getenv("CUR_S3_ENDPOINT")
+CUR_DAYS = int(os.getenv("CUR_DAYS", "7"))
+# Optional comma-separated filters pushed down into the scan
+CUR_ACCOUNT_IDS = [a.strip() for a in os.getenv("CUR_ACCOUNT_IDS", "").split(",") if a.strip()]
+CUR_PRODUCT_CODES = [p.strip() for p in os.getenv("CUR_PRODUCT_CODES", "").split(",") if p.strip()]
+CUR_BATCH_SIZE = int(os.getenv("CUR_BATCH_SIZE", str(128 * 1024)))
+
+PAYER = "bill_payer_account_id"
+ACCOUNT = "line_item_usage_account_id"
+USAGE_START = "line_item_usage_start_date"
+PRODUCT = "line_item_product_code"
+INSTANCE_TYPE = "product_instance_type"
+COST = "line_item_unblended_cost"
+
+# Rollup provider of the CUR facts, kept apart from the Cost Explorer ones ("aws")
+PROVIDER = "aws-cur"
+
+# Only these columns are read from the Parquet files
+COLUMNS = [PAYER, ACCOUNT, USAGE_START, PRODUCT, INSTANCE_TYPE, COST]
+
+GROUP_KEYS = [PAYER, ACCOUNT, PRODUCT, "date"]
+GPU_GROUP_KEYS = [PAYER, ACCOUNT, INSTANCE_TYPE, "date"]
+
+# Compact the partial aggregates once this many have been collected
+MAX_PARTIALS = 64
+
+
+def open_cur_dataset(path=CUR_PATH):
+    """Open the CUR export as a pyarrow dataset, using hive partitions such as BILLING_PERIOD=2025-02."""
+    if path.startswith("s3://"):
+        filesystem = pafs.S3FileSystem(
+            access_key=os.getenv("AWS_ACCESS_KEY_ID"),
+            secret_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            region=os.getenv("AWS_DEFAULT_REGION"),
+            endpoint_override=CUR_S3_ENDPOINT,
+        )
+        path = path[len("s3://"):]
+    else:
+        filesystem = pafs.LocalFileSystem()
+    return ds.dataset(path, format="parquet", filesystem=filesystem, partitioning="hive")
+
+
+def build_filter(dataset, start, end):
+    """Date, account and product predicates evaluated inside the Parquet scan.
+
+    Row groups whose statistics fall outside the window are skipped, and
+    BILLING_PERIOD partitions outside it are never opened.
+    """
+    usage_type = dataset.schema.field(USAGE_START).type
+    start_value, end_value = start, end
+    if usage_type.tz is None:
+        start_value, end_value = start.replace(tzinfo=None), end.replace(tzinfo=None)
+    expression = (ds.field(USAGE_START) >= pa.scalar(start_value, type=usage_type)) & (
+        ds.field(USAGE_START) < pa.scalar(end_value, type=usage_type)
+    )
+
+    if "BILLING_PERIOD" in dataset.schema.names:
+        periods = sorted({(start + timedelta(days=d)).strftime("%Y-%m") for d in range((end - start).days + 1)})
+        expression &= ds.field("BILLING_PERIOD").isin(periods)
+    if CUR_ACCOUNT_IDS:
+        expression &= ds.field(ACCOUNT).isin(CUR_ACCOUNT_IDS)
+    if CUR_PRODUCT_CODES:
+        expression &= ds.field(PRODUCT).isin(CUR_PRODUCT_CODES)
+    return expression
+
+
+def _aggregate(table, keys):
+    result = table.group_by(keys).aggregate([(COST, "sum")])
+    return result.select(keys + [f"{COST}_sum"]).rename_columns(keys + [COST])
+
+
+def _compact(partials, keys):
+    return [_aggregate(pa.concat_tables(partials), keys)]
+
+
+def scan_cur(dataset, start, end):
+    """Stream record batches through the scan and return (per-product, GPU) daily totals.
+
+    Each batch is reduced to per-day group sums right away, so memory is
+    bounded by the number of groups rather than the size of the export.
+    Decoding and filtering run on pyarrow's thread pool across all cores.
+    """
+    scanner = dataset.scanner(
+        columns=COLUMNS,
+        filter=build_filter(dataset, start, end),
+        batch_size=CUR_BATCH_SIZE,
+        use_threads=True,
+    )
+    gpu_types = pa.array(INSTANCE_TYPES_WITH_GPU)
+
+    partials, gpu_partials = [], []
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+        table = pa.Table.from_batches([batch])
+        table = table.append_column("date", pc.cast(table[USAGE_START], pa.date32()))
+        table = table.set_column(table.schema.get_field_index(COST), COST, pc.cast(table[COST], pa.float64()))
+
+        partials.append(_aggregate(table.select(GROUP_KEYS + [COST]), GROUP_KEYS))
+
+        gpu_mask = pc.and_(pc.equal(table[PRODUCT], "AmazonEC2"), pc.is_in(table[INSTANCE_TYPE], value_set=gpu_types))
+        gpu_rows = table.filter(gpu_mask)
+        if gpu_rows.num_rows:
+            gpu_partials.append(_aggregate(gpu_rows.select(GPU_GROUP_KEYS + [COST]), GPU_GROUP_KEYS))
+
+        if len(partials) >= MAX_PARTIALS:
+            partials = _compact(partials, GROUP_KEYS)
+        if len(gpu_partials) >= MAX_PARTIALS:
+            gpu_partials = _compact(gpu_partials, GPU_GROUP_KEYS)
+
+    totals = _compact(partials, GROUP_KEYS)[0] if partials else None
+    gpu_totals = _compact(gpu_partials, GPU_GROUP_KEYS)[0] if gpu_partials else None
+    return totals, gpu_totals
+
+
+def cur_records(table, keys):
+    """Roll the daily totals up to keys and return them as CostRecords, sorted by keys."""
+    if table is None:
+        return []
+    table = _aggregate(table.select(keys + [COST]), keys).sort_by([(key, "ascending") for key in keys])
+    return [
+        CostRecord(
+            PROVIDER,
+            row.get(ACCOUNT, ""),
+            row.get(PRODUCT, ""),
+            row["date"],
+            row[COST],
+            payer=row[PAYER],
+            extra=[row[INSTANCE_TYPE]] if INSTANCE_TYPE in row else [],
+        )
+        for row in table.to_pylist()
+    ]
+
+
+def ingest_cur(path=CUR_PATH, days=CUR_DAYS):
+    """Write the per-account, per-service, per-service-per-account and GPU reports from the CUR."""
+    end = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+
+    totals, gpu_totals = scan_cur(open_cur_dataset(path), start, end)
+    service_account_records = cur_records(totals, [PAYER, ACCOUNT, PRODUCT, "date"])
+    update_rollups(service_account_records)
+
+    # Same schemas as the Cost Explorer reports, under their own names: the CUR identifies
+    # services by product code, so its rows must not be diffed against Cost Explorer's
+    return [
+        write_records_csv(
+            "aws-cur-cost-per-account.csv",
+            ["Payer", "Account", "Date", "Cost"],
+            cur_records(totals, [PAYER, ACCOUNT, "date"]),
+            lambda record: [record.payer, record.account, record.date, record.amount],
+        ),
+        write_records_csv(
+            "aws-cur-cost-per-service.csv",
+            ["Payer", "Service", "Date", "Cost"],
+            cur_records(totals, [PAYER, PRODUCT, "date"]),
+            lambda record: [record.payer, record.service, record.date, record.amount],
+        ),
+        write_records_csv(
+            "aws-cur-cost-per-service-per-account.csv",
+            ["Payer", "Account", "Service", "Date", "Cost"],
+            service_account_records,
+            lambda record: [record.payer, record.account, record.service, record.date, record.amount],
+        ),
+        write_records_csv(
+            "aws-cur-gpu-cost-per-instance.csv",
+            ["Payer", "Account", "Date", "Instance Type", "Cost"],
+            cur_records(gpu_totals, [PAYER, ACCOUNT, "date", INSTANCE_TYPE]),
+            lambda record: [record.payer, record.account, record.date, record.extra[0], record.amount],
+        ),
+    ]
+
+if __name__ == "__main__":
+    print(f"Ingesting AWS Cost and Usage Report from {CUR_PATH}...")
+    for file_path in ingest_cur():
+        print(f"File saved: {file_path}")
@@ -1,70 +1,94 @@
-import boto3
-import csv
-from datetime import datetime, timedelta
 import os
+import sys
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import json  # Added for debugging
+from aws_clients import (
+    collect_from_all_payers,
+    collect_series_from_all_payers,
+    get_cost_and_usage_results,
+    hourly_time_period,
+)
 
-load_dotenv()
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from cost_record import CostRecord, write_records_csv
+from hourly_series import HourlySeriesStore, cost_granularity, hourly_mode, hourly_window
 
-def get_gpu_ec2_cost():
-    # AWS Cost Explorer client setup
-    client = boto3.client(
-        "ce",
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region_name=os.getenv("AWS_DEFAULT_REGION"),
-    )
+load_dotenv()
 
-    # Set the time period for the last 7 days
-    end_date = datetime.utcnow().date()
-    start_date = end_date - timedelta(days=7)
+# GPU-enabled EC2 instance types
+INSTANCE_TYPES_WITH_GPU = [
+    "g5.12xlarge", "g5.2xlarge", "g5.4xlarge",
+    "ml.g5.2xlarge-Hosting", "ml.g5.2xlarge-Notebook",
+    "g4dn.2xlarge", "g4dn.4xlarge", "g4dn.xlarge",
+    "p4d.24xlarge"
+]
 
-    # GPU-enabled EC2 instance types
-    instance_types_with_gpu = [
-        "g5.12xlarge", "g5.2xlarge", "g5.4xlarge",
-        "ml.g5.2xlarge-Hosting", "ml.g5.2xlarge-Notebook",
-        "g4dn.2xlarge", "g4dn.4xlarge", "g4dn.xlarge",
-        "p4d.24xlarge"
-    ]
+def get_gpu_ec2_cost():
+    if hourly_mode():
+        # Hourly data is only kept for the last 14 days
+        start, end = hourly_window()
+        time_period = hourly_time_period(start, end)
+    else:
+        # Set the time period for the last 7 days
+        end_date = datetime.utcnow().date()
+        start_date = end_date - timedelta(days=7)
+        time_period = {"Start": str(start_date), "End": str(end_date)}
 
-    # Query AWS Cost Explorer for EC2 GPU instance costs
-    response = client.get_cost_and_usage(
-        TimePeriod={"Start": str(start_date), "End": str(end_date)},
-        Granularity="DAILY",
-        Metrics=["UnblendedCost"],
-        Filter={
-            "And": [
-                {"Dimensions": {"Key": "SERVICE", "Values": ["Amazon Elastic Compute Cloud - Compute"]}},
-                {"Dimensions": {"Key": "INSTANCE_TYPE", "Values": instance_types_with_gpu}}
-            ]
-        },
-        GroupBy=[
-            {"Type": "DIMENSION", "Key": "LINKED_ACCOUNT"},
-            {"Type": "DIMENSION", "Key": "INSTANCE_TYPE"}
-        ],
-    )
+    def fetch_records(client, payer):
+        # Query AWS Cost Explorer for EC2 GPU instance costs
+        results = get_cost_and_usage_results(
+            client,
+            TimePeriod=time_period,
+            Granularity=cost_granularity(),
+            Metrics=["UnblendedCost"],
+            Filter={
+                "And": [
+                    {"Dimensions": {"Key": "SERVICE", "Values": ["Amazon Elastic Compute Cloud - Compute"]}},
+                    {"Dimensions": {"Key": "INSTANCE_TYPE", "Values": INSTANCE_TYPES_WITH_GPU}}
+                ]
+            },
+            GroupBy=[
+                {"Type": "DIMENSION", "Key": "LINKED_ACCOUNT"},
+                {"Type": "DIMENSION", "Key": "INSTANCE_TYPE"}
+            ],
+        )
 
-    # Print full API response for debugging
-    print("AWS Response:", json.dumps(response, indent=4))
+        # Print full API response for debugging
+        if not hourly_mode():
+            print("AWS Response:", json.dumps(results, indent=4))
 
-    # Prepare the CSV data
-    rows = [["Account", "Date", "Instance Type", "Cost"]]
-    for result in response["ResultsByTime"]:
-        date = result["TimePeriod"]["Start"]
-        for group in result["Groups"]:
-            account = group["Keys"][0]  # AWS Account ID
-            instance_type = group["Keys"][1]  # Instance Type
-            cost = group["Metrics"]["UnblendedCost"]["Amount"]
-            rows.append([account, date, instance_type, cost])
+        for result in results:
+            date = result["TimePeriod"]["Start"]
+            for group in result["Groups"]:
+                account = group["Keys"][0]  # AWS Account ID
+                instance_type = group["Keys"][1]  # Instance Type
+                cost = group["Metrics"]["UnblendedCost"]["Amount"]
+                yield CostRecord(
+                    "aws", account, "Amazon Elastic Compute Cloud - Compute", date, cost,
+                    payer=payer, extra=[instance_type],
+                )
 
-    # Save the data into a CSV file
-    filename = "aws-gpu-cost-per-instance.csv"
-    with open(filename, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerows(rows)
+    if hourly_mode():
+        store = collect_series_from_all_payers(
+            fetch_records,
+            HourlySeriesStore(start, end),
+            lambda record: (record.payer, record.account, record.extra[0]),
+        )
+        return store.write_csv(
+            "aws-gpu-cost-per-instance-hourly.csv",
+            ["Payer", "Account", "Hour", "Instance Type", "Cost"],
+            lambda key, hour, cost: [key[0], key[1], hour, key[2], cost],
+        )
 
-    return filename
+    # Collect the cost records and save them into a CSV file
+    records = collect_from_all_payers(fetch_records)
+    return write_records_csv(
+        "aws-gpu-cost-per-instance.csv",
+        ["Payer", "Account", "Date", "Instance Type", "Cost"],
+        records,
+        lambda record: [record.payer, record.account, record.date, record.extra[0], record.amount],
+    )
 
 if __name__ == "__main__":
     print("Fetching AWS Cost for Specific EC2 GPU Instances...")
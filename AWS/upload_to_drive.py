@@ -1,52 +1,27 @@
-import boto3
-import csv
 import os
-import glob
-from datetime import datetime, timedelta
+import sys
+from datetime import datetime
 from dotenv import load_dotenv
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from google.oauth2.service_account import Credentials
 
-load_dotenv()
-
-def upload_to_google_drive(file_path, folder_structure):
-    """Upload file to Google Drive in specified folder structure."""
-    creds = Credentials.from_service_account_file(os.getenv("SERVICE_ACCOUNT_FILE"))
-    service = build("drive", "v3", credentials=creds)
-
-    # Create folders if not present
-    folder_id = os.getenv("GOOGLE_DRIVE_FOLDER_ID")
-    for folder in folder_structure.split("/"):
-        query = f"'{folder_id}' in parents and name='{folder}' and mimeType='application/vnd.google-apps.folder'"
-        results = service.files().list(q=query, spaces="drive").execute()
-        folders = results.get("files", [])
-        if folders:
-            folder_id = folders[0]["id"]
-        else:
-            file_metadata = {
-                "name": folder,
-                "mimeType": "application/vnd.google-apps.folder",
-                "parents": [folder_id],
-            }
-            folder = service.files().create(body=file_metadata, fields="id").execute()
-            folder_id = folder.get("id")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from output_sink import UploadQueue, backends_from_env, find_reports
 
-    # Upload file
-    file_metadata = {"name": os.path.basename(file_path), "parents": [folder_id]}
-    media = MediaFileUpload(file_path)
-    service.files().create(body=file_metadata, media_body=media, fields="id").execute()
-    print(f"Uploaded {file_path} to Google Drive.")
+load_dotenv()
 
 if __name__ == "__main__":
-    # Uploading the generated CSV files to Google Drive
+    # Uploading the generated reports to Google Drive (and any other OUTPUT_BACKENDS)
     today = datetime.now()
     folder_structure = f"AWS/{today.year}/{today.month}/{today.day}"
 
-    # Use glob to find all .csv files in the current directory
-    csv_files = glob.glob("*.csv")
+    # Only completed reports are found: reports still being written are hidden temp files
+    reports = find_reports()
+
+    # Upload the reports concurrently through a bounded queue
+    with UploadQueue(backends_from_env(), folder_structure) as uploads:
+        for report in reports:
+            print(f"Uploading {report}...")
+            uploads.put(report)
 
-    # Upload each file to Google Drive
-    for csv_file in csv_files:
-        print(f"Uploading {csv_file}...")
-        upload_to_google_drive(csv_file, folder_structure)
+    if uploads.failed:
+        print(f"{len(uploads.failed)} uploads failed")
+        sys.exit(1)
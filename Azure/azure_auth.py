@@ -0,0 +1,52 @@
+import os
+import threading
+import time
+import requests
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Azure Credentials from .env
+AZURE_CLIENT_ID = os.getenv('AZURE_CLIENT_ID')
+AZURE_CLIENT_SECRET = os.getenv('AZURE_CLIENT_SECRET')
+AZURE_TENANT_ID = os.getenv('AZURE_TENANT_ID')
+
+# Refresh the token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+
+_lock = threading.Lock()
+_token = None
+_token_expires_at = 0
+_local = threading.local()
+
+
+# Function to get the Azure access token, reusing it until shortly before it expires
+def get_access_token():
+    global _token, _token_expires_at
+    with _lock:
+        if _token is None or time.time() >= _token_expires_at - TOKEN_REFRESH_MARGIN:
+            url = f"https://login.microsoftonline.com/{AZURE_TENANT_ID}/oauth2/v2.0/token"
+            headers = {
+                "Content-Type": "application/x-www-form-urlencoded"
+            }
+            data = {
+                "grant_type": "client_credentials",
+                "client_id": AZURE_CLIENT_ID,
+                "client_secret": AZURE_CLIENT_SECRET,
+                "scope": "https://management.azure.com/.default"
+            }
+            response = requests.post(url, headers=headers, data=data)
+            response.raise_for_status()  # Raise an error for bad responses
+            token = response.json()
+            _token = token["access_token"]
+            _token_expires_at = time.time() + int(token.get("expires_in", 3600))
+        return _token
+
+
+# Function to get a per-thread HTTP session, so connections to management.azure.com are kept alive
+def http_session():
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
@@ -0,0 +1,274 @@
+import csv
+import glob
+import gzip
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from cost_record import COST_SCALE, CostRecord, write_records_csv
+from change_detection import write_csv
+from rollup_cubes import update_rollups
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Directory (searched recursively) or single file of Cost Management exports
+AZURE_EXPORT_PATH = os.getenv("AZURE_EXPORT_PATH", "exports")
+AZURE_EXPORT_WORKERS = int(os.getenv("AZURE_EXPORT_WORKERS", str(os.cpu_count() or 1)))
+AZURE_EXPORT_BLOCK_SIZE = int(os.getenv("AZURE_EXPORT_BLOCK_SIZE", str(16 * 1024 * 1024)))
+
+# Export column names differ between EA, MCA and older export formats.
+# Each canonical column maps to the names it may appear under.
+COLUMN_ALIASES = {
+    "SubscriptionId": ["SubscriptionId", "SubscriptionGuid"],
+    "SubscriptionName": ["SubscriptionName"],
+    "Date": ["Date", "UsageDate", "UsageDateTime"],
+    "Cost": ["CostInBillingCurrency", "PreTaxCost", "Cost"],
+    "ResourceId": ["ResourceId", "InstanceId"],
+    "ResourceType": ["ResourceType"],
+    "ResourceLocation": ["ResourceLocation"],
+    "ResourceGroupName": ["ResourceGroup", "ResourceGroupName"],
+    "ServiceName": ["MeterCategory", "ServiceName"],
+    "ServiceTier": ["MeterSubCategory", "ServiceTier"],
+    "Meter": ["MeterName", "Meter"],
+    "Currency": ["BillingCurrencyCode", "BillingCurrency", "Currency"],
+}
+GROUP_KEYS = [name for name in COLUMN_ALIASES if name != "Cost"]
+
+# Rollup provider of the export facts, kept apart from the query API ones ("azure")
+PROVIDER = "azure-export"
+
+# Compact the partial aggregates once this many have been collected
+MAX_PARTIALS = 64
+
+
+def find_export_files(path=AZURE_EXPORT_PATH):
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for pattern in ("*.csv", "*.csv.gz", "*.parquet"):
+        files.extend(glob.glob(os.path.join(path, "**", pattern), recursive=True))
+    return sorted(files)
+
+
+def _read_header(file_path):
+    if file_path.endswith(".parquet"):
+        return pq.ParquetFile(file_path).schema_arrow.names
+    opener = gzip.open if file_path.endswith(".gz") else open
+    with opener(file_path, "rt", newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f))
+
+
+def resolve_columns(header):
+    """Map each canonical column to its name in this export file, or None if absent."""
+    by_lower = {name.lower(): name for name in header}
+    mapping = {}
+    for canonical, aliases in COLUMN_ALIASES.items():
+        mapping[canonical] = next((by_lower[a.lower()] for a in aliases if a.lower() in by_lower), None)
+    if mapping["Date"] is None or mapping["Cost"] is None:
+        raise ValueError(f"Export is missing a date or cost column: {header}")
+    return mapping
+
+
+# Stream typed record batches from one export file, reading only the mapped columns
+def iter_batches(file_path, mapping):
+    columns = [name for name in mapping.values() if name is not None]
+    if file_path.endswith(".parquet"):
+        yield from pq.ParquetFile(file_path).iter_batches(columns=columns, batch_size=256 * 1024)
+        return
+
+    column_types = {name: pa.string() for name in columns}
+    column_types[mapping["Cost"]] = pa.float64()
+    reader = pacsv.open_csv(
+        pa.input_stream(file_path, compression="detect"),
+        read_options=pacsv.ReadOptions(block_size=AZURE_EXPORT_BLOCK_SIZE, encoding="utf-8"),
+        convert_options=pacsv.ConvertOptions(include_columns=columns, column_types=column_types),
+    )
+    for batch in reader:
+        yield batch
+
+
+def _aggregate(table):
+    result = table.group_by(GROUP_KEYS).aggregate([("Cost", "sum")])
+    return result.select(GROUP_KEYS + ["Cost_sum"]).rename_columns(GROUP_KEYS + ["Cost"])
+
+
+def aggregate_batch(batch, mapping):
+    """Sum the cost of one record batch per resource and day (runs in a worker process).
+
+    Returns the aggregate and the number of rows skipped for having no date.
+    """
+    columns = {}
+    for canonical, name in mapping.items():
+        if name is None:
+            columns[canonical] = pa.nulls(batch.num_rows, pa.string())
+        elif canonical == "Cost":
+            columns[canonical] = pc.cast(batch.column(name), pa.float64())
+        elif canonical == "Date" and pa.types.is_temporal(batch.column(name).type):
+            # Typed Parquet dates become YYYY-MM-DD, not "2025-02-27 00:00:00.000000"
+            columns[canonical] = pc.cast(pc.cast(batch.column(name), pa.date32()), pa.string())
+        else:
+            columns[canonical] = pc.cast(batch.column(name), pa.string())
+    table = pa.table(columns)
+    dated = pc.is_valid(table.column("Date"))
+    skipped = table.num_rows - pc.sum(dated).as_py() if table.num_rows else 0
+    return _aggregate(table.filter(dated)), skipped
+
+
+def scan_exports(files, workers=AZURE_EXPORT_WORKERS):
+    """Aggregate all export files, farming record batches out to worker processes.
+
+    At most two batches per worker are in flight, so memory stays bounded
+    regardless of file size.
+    """
+    partials = []
+    skipped = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for file_path in files:
+            print(f"Reading {file_path}...")
+            mapping = resolve_columns(_read_header(file_path))
+            for batch in iter_batches(file_path, mapping):
+                pending.append(executor.submit(aggregate_batch, batch, mapping))
+                if len(pending) >= 2 * workers:
+                    partial, batch_skipped = pending.pop(0).result()
+                    partials.append(partial)
+                    skipped += batch_skipped
+                if len(partials) >= MAX_PARTIALS:
+                    partials = [_aggregate(pa.concat_tables(partials))]
+        for future in pending:
+            partial, batch_skipped = future.result()
+            partials.append(partial)
+            skipped += batch_skipped
+    if skipped:
+        print(f"Skipped {skipped} export rows without a date.")
+    if not partials:
+        return None
+    return _aggregate(pa.concat_tables(partials))
+
+
+_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%Y%m%d")
+_date_cache = {}
+
+
+def normalize_date(value):
+    """Return the export date (MM/DD/YYYY, YYYY-MM-DD or a timestamp) as YYYY-MM-DD."""
+    normalized = _date_cache.get(value)
+    if normalized is None:
+        text = value.strip().split("T")[0].split(" ")[0]
+        for date_format in _DATE_FORMATS:
+            try:
+                normalized = datetime.strptime(text, date_format).strftime("%Y-%m-%d")
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"Unrecognised export date: {value}")
+        _date_cache[value] = normalized
+    return normalized
+
+
+def resource_type(resource_id):
+    """Derive e.g. microsoft.compute/virtualmachines from a resource ID."""
+    if not resource_id or "/providers/" not in resource_id.lower():
+        return ""
+    tail = resource_id[resource_id.lower().rindex("/providers/") + len("/providers/"):]
+    parts = tail.split("/")
+    return "/".join([parts[0]] + parts[1::2]).lower()
+
+
+# Convert the aggregated export rows into resource-level CostRecords
+def export_records(totals):
+    records = []
+    for row in totals.to_pylist() if totals is not None else []:
+        records.append(CostRecord(
+            PROVIDER,
+            row["SubscriptionId"],
+            row["ServiceName"],
+            normalize_date(row["Date"]),
+            row["Cost"] or 0.0,
+            account_name=row["SubscriptionName"],
+            currency=row["Currency"] or "USD",
+            extra=[
+                row["ResourceId"],
+                row["ResourceType"] or resource_type(row["ResourceId"]),
+                row["ResourceLocation"],
+                row["ResourceGroupName"],
+                row["ServiceTier"],
+                row["Meter"],
+            ],
+        ))
+    return records
+
+
+# Sum records sharing the same key(record), in fixed point; returns (key, amount) pairs sorted by key
+def rollup(records, key):
+    totals = {}
+    for record in records:
+        k = key(record)
+        totals[k] = totals.get(k, 0) + record.cost
+    return [(k, cost / COST_SCALE) for k, cost in sorted(totals.items())]
+
+
+def _write_csv(filename, header, rows):
+    path = write_csv(filename, header, rows)
+    print(f"Data has been written to {path}")
+    return path
+
+
+# Write the resource-level report and the subscription/service rollups
+def write_reports(totals):
+    records = export_records(totals)
+    records.sort(key=lambda record: (record.day, record.extra))
+    update_rollups(records)
+
+    resources_file = write_records_csv(
+        "azure_cost_resources.csv",
+        ["UsageDate", "CostUSD", "ResourceId", "ResourceType", "ResourceLocation",
+         "ResourceGroupName", "ServiceName", "ServiceTier", "Meter", "Currency"],
+        records,
+        lambda record: [record.date, record.amount] + list(record.extra[:4])
+        + [record.service] + list(record.extra[4:]) + [record.currency],
+    )
+    print(f"Data has been written to {resources_file}")
+
+    return [
+        resources_file,
+        _write_csv(
+            "azure_cost_data_per_service_across_all_accounts.csv",
+            ["SubscriptionID", "PreTaxCost", "UsageDate", "ServiceName", "Currency"],
+            ([k[0], cost, k[1], k[2], k[3]] for k, cost in rollup(
+                records, lambda r: (r.account, r.usage_date, r.service, r.currency))),
+        ),
+        _write_csv(
+            "azure_cost_data_per_account.csv",
+            ["SubscriptionID", "SubscriptionName", "PreTaxCost", "UsageDate", "Currency"],
+            ([k[0], k[1], cost, k[2], k[3]] for k, cost in rollup(
+                records, lambda r: (r.account, r.account_name, r.usage_date, r.currency))),
+        ),
+        _write_csv(
+            "azure_cost_data_per_service_per_account.csv",
+            ["SubscriptionID", "SubscriptionName", "PreTaxCost", "UsageDate", "ServiceName", "Currency"],
+            ([k[0], k[1], cost, k[2], k[3], k[4]] for k, cost in rollup(
+                records, lambda r: (r.account, r.account_name, r.usage_date, r.service, r.currency))),
+        ),
+    ]
+
+
+# Main function: build the reports from export files, without any query API calls
+def main():
+    files = find_export_files()
+    if not files:
+        print(f"No export files found in {AZURE_EXPORT_PATH}.")
+        return
+    write_reports(scan_exports(files))
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,28 @@
 import os
 import requests
-import csv
 import time
+import sys
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from cost_record import records_from_azure_response, write_records_csv
+from hourly_series import warn_daily_only
+from azure_auth import get_access_token, http_session
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Load Azure Subscription IDs from .env
 AZURE_SUBSCRIPTION_IDS = os.getenv('AZURE_SUBSCRIPTION_ID').split(',')
 
-# Azure Credentials from .env
-AZURE_CLIENT_ID = os.getenv('AZURE_CLIENT_ID')
-AZURE_CLIENT_SECRET = os.getenv('AZURE_CLIENT_SECRET')
-AZURE_TENANT_ID = os.getenv('AZURE_TENANT_ID')
-
-# Function to get the Azure access token
-def get_access_token():
-    url = f"https://login.microsoftonline.com/{AZURE_TENANT_ID}/oauth2/v2.0/token"
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": AZURE_CLIENT_ID,
-        "client_secret": AZURE_CLIENT_SECRET,
-        "scope": "https://management.azure.com/.default"
-    }
-    response = requests.post(url, headers=headers, data=data)
-    response.raise_for_status()
-    return response.json()["access_token"]
-
 # Function to get cost data for a specific subscription
-def get_cost_data(subscription_id):
-    end_date = datetime.now(timezone.utc)
-    start_date = end_date - timedelta(days=7)
+def get_cost_data(subscription_id, start_date=None, end_date=None):
+    # Last 7 days, unless a window is given
+    if end_date is None:
+        end_date = datetime.now(timezone.utc)
+    if start_date is None:
+        start_date = end_date - timedelta(days=7)
     
     start_date = start_date.isoformat()
     end_date = end_date.isoformat()
@@ -57,7 +46,7 @@ def get_cost_data(subscription_id):
     retries = 0
     
     while retries < max_retries:
-        response = requests.post(url, json=query, headers=headers)
+        response = http_session().post(url, json=query, headers=headers)
         
         if response.status_code == 429:
             print("Rate limit hit, retrying in 30 seconds...")
@@ -70,40 +59,45 @@ def get_cost_data(subscription_id):
     
     raise Exception(f"Failed after {max_retries} retries due to rate limiting.")
 
+# Function to get the Cognitive Services cost records for a subscription
+def get_cost_records(subscription_id, start_date=None, end_date=None):
+    records = records_from_azure_response(get_cost_data(subscription_id, start_date, end_date), subscription_id)
+    return [record for record in records if "Cognitive Services" in record.service]
+
 # Function to write filtered Cognitive Services cost data to CSV
-def write_to_csv(all_data):
+def write_to_csv(records):
     csv_filename = "azure_cognitive_services_cost_data.csv"
-    with open(csv_filename, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["SubscriptionID", "PreTaxCost", "UsageDate", "ServiceName", "Currency"])
-        
-        for subscription_id, data in all_data.items():
-            rows = data.get("properties", {}).get("rows", [])
-            if rows:
-                for row in rows:
-                    service_name = row[2]  # Assuming ServiceName is the third column
-                    if "Cognitive Services" in service_name:
-                        writer.writerow([subscription_id] + row)
+    csv_path = write_records_csv(
+        csv_filename,
+        ["SubscriptionID", "PreTaxCost", "UsageDate", "ServiceName", "Currency"],
+        records,
+        lambda record: [record.account, record.amount, record.usage_date, record.service, record.currency],
+    )
     
-    print(f"Data has been written to {csv_filename}")
+    print(f"Data has been written to {csv_path}")
+
+# Function to write the reports for the collected records
+def write_reports(records):
+    if records:
+        write_to_csv(records)
+    else:
+        print("No data available.")
 
 # Main function
 def main():
-    all_data = {}
+    warn_daily_only()
+
+    records = []
     
     for subscription_id in AZURE_SUBSCRIPTION_IDS:
         try:
-            data = get_cost_data(subscription_id)
-            all_data[subscription_id] = data
+            records.extend(get_cost_records(subscription_id))
         except requests.exceptions.RequestException as e:
             print(f"Error while fetching data for Subscription {subscription_id}: {e}")
         except Exception as e:
             print(f"An error occurred while fetching data for Subscription {subscription_id}: {e}")
     
-    if all_data:
-        write_to_csv(all_data)
-    else:
-        print("No data available.")
+    write_reports(records)
 
 if __name__ == "__main__":
     main()
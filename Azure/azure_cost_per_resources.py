@@ -1,11 +1,17 @@
 import requests
 import json
-import csv
 import os
-from datetime import datetime
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
 from azure.identity import ClientSecretCredential
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from cost_record import records_from_azure_response, write_records_csv
+from azure_auth import http_session
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -15,33 +21,87 @@ CLIENT_ID = os.getenv("AZURE_CLIENT_ID")
 CLIENT_SECRET = os.getenv("AZURE_CLIENT_SECRET")
 SUBSCRIPTION_ID = os.getenv("AZURE_SUBSCRIPTION_ID")
 
-# Get Azure Access Token
+# The credential caches its token, so it is created once and reused across runs
+_credential = None
+
+# Get Azure Access Token; raises if the token cannot be obtained
 def get_access_token():
-    try:
-        credential = ClientSecretCredential(TENANT_ID, CLIENT_ID, CLIENT_SECRET)
-        token = credential.get_token("https://management.azure.com/.default")
-        return token.token
-    except Exception as e:
-        print(f"Error getting access token: {e}")
-        return None
-
-# Fetch Cost Data for Today
-def fetch_cost_data():
-    today = datetime.today().strftime('%Y-%m-%d')  # Get today's date in YYYY-MM-DD format
-    
-    url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/providers/Microsoft.CostManagement/query?api-version=2023-03-01"
-    
-    headers = {
-        "Authorization": f"Bearer {get_access_token()}",
-        "Content-Type": "application/json"
-    }
-    
+    global _credential
+    if _credential is None:
+        _credential = ClientSecretCredential(TENANT_ID, CLIENT_ID, CLIENT_SECRET)
+    token = _credential.get_token("https://management.azure.com/.default")
+    return token.token
+
+# Days of resource-level cost to fetch, ending today
+RESOURCE_COST_DAYS = int(os.getenv("RESOURCE_COST_DAYS", "7"))
+# A result with this many rows (or a nextLink) is treated as truncated and split
+RESOURCE_QUERY_ROW_LIMIT = int(os.getenv("RESOURCE_QUERY_ROW_LIMIT", "5000"))
+# Partitions queried at the same time
+RESOURCE_QUERY_WORKERS = int(os.getenv("RESOURCE_QUERY_WORKERS", "4"))
+
+QUERY_URL = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/providers/Microsoft.CostManagement/query?api-version=2023-03-01"
+
+RESOURCE_GROUPING = [
+    {"type": "Dimension", "name": "ResourceId"},
+    {"type": "Dimension", "name": "ResourceType"},
+    {"type": "Dimension", "name": "ResourceLocation"},
+    {"type": "Dimension", "name": "ResourceGroupName"},
+    {"type": "Dimension", "name": "ServiceName"},
+    {"type": "Dimension", "name": "ServiceTier"},
+    {"type": "Dimension", "name": "Meter"}
+]
+
+# Dimensions a single-day query is split by, in order, once date splitting is exhausted
+SPLIT_DIMENSIONS = ("ResourceGroupName", "ServiceName")
+
+
+class QueryError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def transient(self):
+        """Server-side failures (5xx) may succeed on a smaller query; 4xx ones, including
+        running out of rate-limit retries (429), will not."""
+        return self.status_code is not None and self.status_code >= 500
+
+
+class Partition:
+    """A slice of the resource query: an inclusive date range plus dimension filters.
+
+    filters maps a dimension to the single value the query is filtered on.
+    The query filter cannot match an empty value, so rows with an empty
+    value are selected client-side instead: empty lists the dimensions
+    whose rows are kept only if the value is empty.
+    """
+
+    def __init__(self, start, end, filters=None, empty=()):
+        self.start = start
+        self.end = end
+        self.filters = filters or {}
+        self.empty = tuple(empty)
+
+    def with_filter(self, dimension, value):
+        return Partition(self.start, self.end, dict(self.filters, **{dimension: value}), self.empty)
+
+    def with_empty(self, dimension):
+        return Partition(self.start, self.end, self.filters, self.empty + (dimension,))
+
+    def __str__(self):
+        filters = [f"{dimension}={value}" for dimension, value in self.filters.items()]
+        filters += [f"{dimension} empty" for dimension in self.empty]
+        return f"{self.start}..{self.end}" + (f" [{', '.join(filters)}]" if filters else "")
+
+
+# Build the query payload for a partition
+def build_query(partition, grouping):
     payload = {
         "type": "ActualCost",
         "timeframe": "Custom",
         "timePeriod": {
-            "from": today,  # Start date (today)
-            "to": today     # End date (today)
+            "from": partition.start.isoformat(),
+            "to": partition.end.isoformat()
         },
         "dataset": {
             "granularity": "Daily",
@@ -51,51 +111,195 @@ def fetch_cost_data():
                     "function": "Sum"
                 }
             },
-            "grouping": [
-                {"type": "Dimension", "name": "ResourceId"},
-                {"type": "Dimension", "name": "ResourceType"},
-                {"type": "Dimension", "name": "ResourceLocation"},
-                {"type": "Dimension", "name": "ResourceGroupName"},
-                {"type": "Dimension", "name": "ServiceName"},
-                {"type": "Dimension", "name": "ServiceTier"},
-                {"type": "Dimension", "name": "Meter"}
-            ]
+            "grouping": grouping
         }
     }
 
-    response = requests.post(url, headers=headers, json=payload)
+    expressions = [
+        {"dimensions": {"name": dimension, "operator": "In", "values": [value]}}
+        for dimension, value in partition.filters.items()
+    ]
+    if len(expressions) == 1:
+        payload["dataset"]["filter"] = expressions[0]
+    elif expressions:
+        payload["dataset"]["filter"] = {"and": expressions}
+    return payload
+
+
+# Post a query, retrying when rate limited; raises QueryError on any other non-200 response
+def post_query(payload, url=QUERY_URL):
+    headers = {
+        "Authorization": f"Bearer {get_access_token()}",
+        "Content-Type": "application/json"
+    }
 
-    if response.status_code == 200:
+    max_retries = 5
+    for _ in range(max_retries):
+        response = http_session().post(url, headers=headers, json=payload)
+        if response.status_code == 429:
+            retry_after = response.headers.get("x-ms-ratelimit-microsoft.costmanagement-entity-retry-after")
+            time.sleep(int(retry_after or 30))
+            continue
+        if response.status_code != 200:
+            raise QueryError(f"{response.status_code}, {response.text[:200]}", response.status_code)
         return response.json()
-    else:
-        print(f"Error fetching cost data: {response.status_code}, {response.text}")
-        return None
+
+    raise QueryError(f"Failed after {max_retries} retries due to rate limiting.", 429)
+
+
+# Convert a response to records, dropping rows excluded by the partition's empty-value dimensions
+def partition_records(partition, data):
+    if partition.empty:
+        columns = [column["name"] for column in data["properties"]["columns"]]
+        indexes = [columns.index(dimension) for dimension in partition.empty]
+        data["properties"]["rows"] = [
+            row for row in data["properties"]["rows"] if not any(row[i] for i in indexes)
+        ]
+    return records_from_azure_response(data, SUBSCRIPTION_ID)
+
+
+# Fetch every page of a partition; only used for partitions that cannot be split further
+def fetch_all_pages(partition):
+    payload = build_query(partition, RESOURCE_GROUPING)
+    data = post_query(payload)
+    next_link = data["properties"].get("nextLink")
+    records = partition_records(partition, data)
+    while next_link:
+        data = post_query(payload, next_link)
+        next_link = data["properties"].get("nextLink")
+        records.extend(partition_records(partition, data))
+    return records
+
+
+# Distinct values of a dimension within a partition (a small query grouped by that dimension only)
+def dimension_values(partition, dimension):
+    payload = build_query(partition, [{"type": "Dimension", "name": dimension}])
+    data = post_query(payload)
+    columns = [column["name"] for column in data["properties"]["columns"]]
+    index = columns.index(dimension)
+    values = {row[index] or "" for row in data["properties"]["rows"]}
+    next_link = data["properties"].get("nextLink")
+    while next_link:
+        data = post_query(payload, next_link)
+        values.update(row[index] or "" for row in data["properties"]["rows"])
+        next_link = data["properties"].get("nextLink")
+    return sorted(values)
+
+
+# Whether a failed query is worth retrying as smaller queries
+def splittable_error(error):
+    if isinstance(error, QueryError):
+        return error.transient
+    return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+
+# Split a partition: halve the date range, else one partition per value of the next dimension
+def split_partition(partition):
+    if partition.end > partition.start:
+        middle = partition.start + (partition.end - partition.start) // 2
+        return [
+            Partition(partition.start, middle, partition.filters),
+            Partition(middle + timedelta(days=1), partition.end, partition.filters),
+        ]
+
+    for dimension in SPLIT_DIMENSIONS:
+        if dimension in partition.filters or dimension in partition.empty:
+            continue
+        values = dimension_values(partition, dimension)
+        if len(values) < 2:
+            continue
+        children = [partition.with_filter(dimension, value) for value in values if value]
+        if "" in values:
+            # Still queries the whole partition, but can be split by the next dimension
+            children.append(partition.with_empty(dimension))
+        return children
+    return []
+
+
+# Query one partition; returns (records, child partitions to query instead, error)
+# Only truncated results and server-side failures are split; client errors
+# (400/401/403) are reported as they are, since smaller queries fail the same way.
+def run_partition(partition):
+    try:
+        data = post_query(build_query(partition, RESOURCE_GROUPING))
+        rows = data["properties"]["rows"]
+        if not data["properties"].get("nextLink") and len(rows) < RESOURCE_QUERY_ROW_LIMIT:
+            return partition_records(partition, data), [], None
+        problem = f"{len(rows)} rows, truncated"
+    except (QueryError, requests.exceptions.RequestException) as e:
+        if not splittable_error(e):
+            return [], [], f"{partition}: {e}"
+        problem = str(e)
+
+    try:
+        children = split_partition(partition)
+        if children:
+            print(f"Splitting {partition} into {len(children)} queries ({problem})")
+            return [], children, None
+        # Cannot be split further: page through the result instead
+        return fetch_all_pages(partition), [], None
+    except (QueryError, requests.exceptions.RequestException) as e:
+        return [], [], f"{partition}: {problem}; {e}"
+
+
+# Fetch resource-level cost for the last RESOURCE_COST_DAYS days, splitting oversized or failing queries.
+# Raises QueryError if any partition could not be fetched, so an incomplete report is never written.
+def fetch_cost_data(start=None, end=None):
+    end = end or datetime.today().date()
+    start = start or end - timedelta(days=RESOURCE_COST_DAYS - 1)
+
+    records = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=RESOURCE_QUERY_WORKERS) as executor:
+        pending = {executor.submit(run_partition, Partition(start, end))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                found, children, error = future.result()
+                records.extend(found)
+                if error:
+                    errors.append(error)
+                pending.update(executor.submit(run_partition, child) for child in children)
+
+    for error in errors:
+        print(f"Error fetching cost data: {error}")
+    if errors:
+        raise QueryError(f"{len(errors)} resource cost queries failed; the report was not written")
+    return records
 
 # Save Data to CSV
-def save_to_csv(data):
-    if not data or "properties" not in data or "rows" not in data["properties"]:
+def save_to_csv(records):
+    if not records:
         print("No data available to save.")
         return
     
     filename = "azure_cost_resources.csv"
 
-    with open(filename, "w", newline="") as file:
-        writer = csv.writer(file)
-        
-        writer.writerow([
+    # Columns are matched by name; extra holds the resource groupings in request order:
+    # ResourceId, ResourceType, ResourceLocation, ResourceGroupName, ServiceTier, Meter
+    records.sort(key=lambda record: (record.day, record.extra))
+
+    file_path = write_records_csv(
+        filename,
+        [
             "UsageDate", "CostUSD", "ResourceId", "ResourceType", "ResourceLocation", 
             "ResourceGroupName", "ServiceName", "ServiceTier", "Meter", "Currency"
-        ])
-        
-        for row in data["properties"]["rows"]:
-            if len(row) >= 7:
-                usage_date = datetime.today().strftime('%Y-%m-%d')
-                cost_usd = row[-1]
-                writer.writerow([usage_date, cost_usd] + row[:-1] + ["USD"])
+        ],
+        records,
+        lambda record: [record.date, record.amount] + list(record.extra[:4])
+        + [record.service] + list(record.extra[4:]) + [record.currency],
+    )
 
-    print(f"Data successfully saved to {filename}")
+    print(f"Data successfully saved to {file_path}")
 
 # Main Execution
+def main():
+    records = fetch_cost_data()
+    save_to_csv(records)
+
 if __name__ == "__main__":
-    cost_data = fetch_cost_data()
-    save_to_csv(cost_data)
+    try:
+        main()
+    except QueryError as e:
+        print(e)
+        sys.exit(1)
@@ -1,37 +1,22 @@
 import os
 import requests
-import csv
 import time
+import sys
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv  # Import the dotenv module
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from cost_record import records_from_azure_response, write_records_csv
+from hourly_series import warn_daily_only
+from rollup_cubes import update_rollups
+from azure_auth import get_access_token, http_session
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Load Azure Subscription IDs from .env
 AZURE_SUBSCRIPTION_IDS = os.getenv('AZURE_SUBSCRIPTION_ID').split(',')
 
-# Azure Credentials from .env
-AZURE_CLIENT_ID = os.getenv('AZURE_CLIENT_ID')
-AZURE_CLIENT_SECRET = os.getenv('AZURE_CLIENT_SECRET')
-AZURE_TENANT_ID = os.getenv('AZURE_TENANT_ID')
-
-# Function to get the Azure access token
-def get_access_token():
-    url = f"https://login.microsoftonline.com/{AZURE_TENANT_ID}/oauth2/v2.0/token"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": AZURE_CLIENT_ID,
-        "client_secret": AZURE_CLIENT_SECRET,
-        "scope": "https://management.azure.com/.default"
-    }
-    response = requests.post(url, headers=headers, data=data)
-    response.raise_for_status()  # Raise an error for bad responses
-    return response.json()["access_token"]
-
 # Function to get subscription details (including account name)
 def get_subscription_details(subscription_id):
     url = f"https://management.azure.com/subscriptions/{subscription_id}?api-version=2020-01-01"
@@ -39,7 +24,7 @@ def get_subscription_details(subscription_id):
         "Authorization": f"Bearer {get_access_token()}"
     }
 
-    response = requests.get(url, headers=headers)
+    response = http_session().get(url, headers=headers)
     response.raise_for_status()  # Raise an error for bad responses
     subscription_data = response.json()
     
@@ -50,10 +35,12 @@ def get_subscription_details(subscription_id):
     return subscription_name, subscription_account_number
 
 # Function to get the cost data for each subscription, per service
-def get_cost_data(subscription_id):
-    # Set the date range for the last 7 days
-    end_date = datetime.now(timezone.utc)
-    start_date = end_date - timedelta(days=7)  # Last 7 days
+def get_cost_data(subscription_id, start_date=None, end_date=None):
+    # Set the date range for the last 7 days, unless a window is given
+    if end_date is None:
+        end_date = datetime.now(timezone.utc)
+    if start_date is None:
+        start_date = end_date - timedelta(days=7)  # Last 7 days
 
     # Format dates in ISO 8601 format (Azure API requires this)
     start_date = start_date.isoformat()
@@ -93,7 +80,7 @@ def get_cost_data(subscription_id):
     retries = 0
 
     while retries < max_retries:
-        response = requests.post(url, json=query, headers=headers)
+        response = http_session().post(url, json=query, headers=headers)
 
         if response.status_code == 429:  # Too Many Requests
             print("Rate limit hit, retrying in 30 seconds...")
@@ -109,42 +96,52 @@ def get_cost_data(subscription_id):
 
     raise Exception(f"Failed after {max_retries} retries due to rate limiting.")
 
+# Function to get the cost records for a subscription, tagged with its account name
+def get_cost_records(subscription_id, start_date=None, end_date=None):
+    data = get_cost_data(subscription_id, start_date, end_date)
+    if not data.get("properties", {}).get("rows"):
+        return []
+    subscription_name, subscription_account_number = get_subscription_details(subscription_id)
+    return records_from_azure_response(data, subscription_account_number, subscription_name)
+
 # Function to write cost data to CSV
-def write_to_csv(all_data):
+def write_to_csv(records):
     # Prepare the CSV file
     csv_filename = "azure_cost_data_per_service_per_account.csv"
-    with open(csv_filename, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        # Write the header
-        writer.writerow(["SubscriptionID", "SubscriptionName", "PreTaxCost", "UsageDate", "ServiceName"])
-
-        # Write the data rows for all subscriptions
-        for subscription_id, data in all_data.items():
-            rows = data.get("properties", {}).get("rows", [])
-            if rows:
-                subscription_name, subscription_account_number = get_subscription_details(subscription_id)
-                for row in rows:
-                    writer.writerow([subscription_account_number, subscription_name] + row)  # Add account number and name to each row
-
-    print(f"Data has been written to {csv_filename}")
+    csv_path = write_records_csv(
+        csv_filename,
+        ["SubscriptionID", "SubscriptionName", "PreTaxCost", "UsageDate", "ServiceName"],
+        records,
+        lambda record: [
+            record.account, record.account_name, record.amount, record.usage_date, record.service, record.currency
+        ],
+    )
+
+    print(f"Data has been written to {csv_path}")
+
+# Function to write the reports for the collected records
+def write_reports(records):
+    if records:
+        update_rollups(records)
+        write_to_csv(records)
+    else:
+        print("No data available.")
 
 # Main function to fetch and store data
 def main():
-    all_data = {}
+    warn_daily_only()
+
+    records = []
 
     for subscription_id in AZURE_SUBSCRIPTION_IDS:
         try:
-            data = get_cost_data(subscription_id)
-            all_data[subscription_id] = data
+            records.extend(get_cost_records(subscription_id))
         except requests.exceptions.RequestException as e:
             print(f"Error while fetching data for Subscription {subscription_id}: {e}")
         except Exception as e:
             print(f"An error occurred while fetching data for Subscription {subscription_id}: {e}")
 
-    if all_data:
-        write_to_csv(all_data)
-    else:
-        print("No data available.")
+    write_reports(records)
 
 if __name__ == "__main__":
     main()
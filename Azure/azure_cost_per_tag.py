@@ -0,0 +1,129 @@
+import os
+import requests
+import time
+import sys
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from cost_record import records_from_azure_response, write_records_csv
+from tag_index import update_tag_index
+from azure_auth import get_access_token, http_session
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Load Azure Subscription IDs from .env
+AZURE_SUBSCRIPTION_IDS = os.getenv('AZURE_SUBSCRIPTION_ID').split(',')
+
+# Cost allocation tag keys to collect, e.g. "team,project,cost-center"
+COST_ALLOCATION_TAG_KEYS = [k.strip() for k in os.getenv("COST_ALLOCATION_TAG_KEYS", "").split(",") if k.strip()]
+
+# Function to get the cost data for a subscription, grouped by the values of one tag key
+def get_cost_data(subscription_id, tag_key, start_date=None, end_date=None):
+    # Set the date range for the last 7 days, unless a window is given
+    if end_date is None:
+        end_date = datetime.now(timezone.utc)
+    if start_date is None:
+        start_date = end_date - timedelta(days=7)  # Last 7 days
+
+    # Format dates in ISO 8601 format (Azure API requires this)
+    start_date = start_date.isoformat()
+    end_date = end_date.isoformat()
+
+    # Cost Management API endpoint for each subscription
+    url = f"https://management.azure.com/subscriptions/{subscription_id}/providers/Microsoft.CostManagement/query?api-version=2019-11-01"
+
+    # Set query parameters for the Cost Management API (breakdown by tag value)
+    query = {
+        "type": "Usage",
+        "timeframe": "Custom",
+        "timePeriod": {
+            "from": start_date,
+            "to": end_date
+        },
+        "dataset": {
+            "granularity": "Daily",
+            "aggregation": {
+                "totalCost": {
+                    "name": "PreTaxCost",
+                    "function": "Sum"
+                }
+            },
+            "grouping": [
+                {"type": "TagKey", "name": tag_key}  # Returns TagKey and TagValue columns
+            ]
+        }
+    }
+
+    headers = {
+        "Authorization": f"Bearer {get_access_token()}"
+    }
+
+    # Retry logic for handling 429 (Too Many Requests) error
+    max_retries = 5
+    retries = 0
+
+    while retries < max_retries:
+        response = http_session().post(url, json=query, headers=headers)
+
+        if response.status_code == 429:  # Too Many Requests
+            print("Rate limit hit, retrying in 30 seconds...")
+            time.sleep(30)  # Wait for 30 seconds before retrying
+            retries += 1
+        else:
+            response.raise_for_status()
+            return response.json()
+
+    raise Exception(f"Failed after {max_retries} retries due to rate limiting.")
+
+# Function to get the tagged cost records for a subscription; extra holds (TagKey, TagValue)
+def get_cost_records(subscription_id, start_date=None, end_date=None):
+    records = []
+    for tag_key in COST_ALLOCATION_TAG_KEYS:
+        data = get_cost_data(subscription_id, tag_key, start_date, end_date)
+        for record in records_from_azure_response(data, subscription_id):
+            # Untagged cost comes back without a TagKey; keep it under the requested key
+            if not record.extra[0]:
+                record.extra = (tag_key,) + record.extra[1:]
+            records.append(record)
+    return records
+
+# Function to write cost data to CSV
+def write_to_csv(records):
+    csv_filename = "azure_cost_data_per_tag.csv"
+    csv_path = write_records_csv(
+        csv_filename,
+        ["SubscriptionID", "PreTaxCost", "UsageDate", "TagKey", "TagValue", "Currency"],
+        records,
+        lambda record: [
+            record.account, record.amount, record.usage_date, record.extra[0], record.extra[1], record.currency
+        ],
+    )
+
+    print(f"Data has been written to {csv_path}")
+
+# Function to write the reports for the collected records
+def write_reports(records):
+    if records:
+        update_tag_index(records)
+        write_to_csv(records)
+    else:
+        print("No data available.")
+
+# Main function to fetch and store data
+def main():
+    records = []
+
+    for subscription_id in AZURE_SUBSCRIPTION_IDS:
+        try:
+            records.extend(get_cost_records(subscription_id))
+        except requests.exceptions.RequestException as e:
+            print(f"Error while fetching data for Subscription {subscription_id}: {e}")
+        except Exception as e:
+            print(f"An error occurred while fetching data for Subscription {subscription_id}: {e}")
+
+    write_reports(records)
+
+if __name__ == "__main__":
+    main()
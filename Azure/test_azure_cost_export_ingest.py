@@ -0,0 +1,37 @@
+import os
+import sys
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from azure_cost_export_ingest import export_records, find_export_files, normalize_date, scan_exports
+
+
+def test_normalize_date_accepts_timestamps():
+    assert normalize_date("2025-02-27T00:00:00Z") == "2025-02-27"
+    assert normalize_date("2025-02-27 00:00:00.000000") == "2025-02-27"
+    assert normalize_date("02/27/2025") == "2025-02-27"
+
+
+def test_typed_parquet_export(tmp_path):
+    table = pa.table({
+        "SubscriptionId": ["sub-1", "sub-1", "sub-1", "sub-1"],
+        "SubscriptionName": ["Production"] * 4,
+        "Date": pa.array(
+            [datetime(2025, 2, 27), datetime(2025, 2, 27, 13), datetime(2025, 2, 28), None],
+            type=pa.timestamp("us"),
+        ),
+        "CostInBillingCurrency": [1.5, 2.5, 4.0, 100.0],
+        "ResourceId": ["/subscriptions/sub-1/resourceGroups/rg/providers/Microsoft.Compute/virtualMachines/vm1"] * 4,
+        "MeterCategory": ["Virtual Machines"] * 4,
+        "BillingCurrencyCode": ["USD"] * 4,
+    })
+    pq.write_table(table, tmp_path / "export.parquet")
+
+    records = export_records(scan_exports(find_export_files(str(tmp_path)), workers=1))
+
+    by_date = {record.date: record.amount for record in records}
+    # The row without a date is skipped, not counted against a day
+    assert by_date == {"2025-02-27": 4.0, "2025-02-28": 4.0}
+    assert all(record.extra[1] == "microsoft.compute/virtualmachines" for record in records)
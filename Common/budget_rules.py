@@ -0,0 +1,185 @@
+import argparse
+import calendar
+import csv
+import os
+import sys
+from datetime import date
+import numpy as np
+from change_detection import write_csv
+from cost_record import COST_SCALE
+from rollup_cubes import connect as connect_rollups
+from tag_index import TagIndex, tag_index_path
+from output_sink import state_path
+
+# Rules file columns:
+#   RuleID     any identifier, copied to the alerts
+#   Scope      total, account, service, account_service or tag
+#   Value      account ID, service name, "account|service" or "key=value" (empty for total)
+#   Period     daily (spend on the as-of day), mtd, or forecast (month-end projection)
+#   Limit      budget in the report currency
+#   AlertAt    optional fraction of the limit that triggers the alert (default 1.0)
+SCOPES = ("total", "account", "service", "account_service", "tag")
+PERIODS = ("daily", "mtd", "forecast")
+ALERTS_REPORT = "budget-alerts.csv"
+
+# Settings are read when called
+#   BUDGET_PROVIDERS    rollup providers whose facts count as spend (default: aws,azure).
+#                       Use aws-cur / azure-export when the CUR or exports are the source
+#                       instead; listing both feeds of a cloud would count its spend twice.
+
+
+def budget_providers():
+    return [p.strip() for p in os.getenv("BUDGET_PROVIDERS", "aws,azure").split(",") if p.strip()]
+
+
+def budget_rules_path():
+    return state_path("BUDGET_RULES_PATH", "budget_rules.csv")
+
+
+class CompiledRules:
+    """Rules as parallel numpy arrays: spend row, period code, limit and alert fraction.
+
+    Each rule's (scope, value) is resolved to its row of the spend table
+    once, when the rules are compiled, so evaluating them is a single gather.
+    """
+
+    def __init__(self, rows, spend):
+        self.ids = [row["RuleID"] for row in rows]
+        self.values = [(row.get("Value") or "").strip() for row in rows]
+        self.scope = np.array([SCOPES.index(row["Scope"].strip().lower()) for row in rows], dtype=np.int8)
+        self.period = np.array([PERIODS.index(row["Period"].strip().lower()) for row in rows], dtype=np.int8)
+        self.limit = np.array([float(row["Limit"]) for row in rows], dtype=np.float64)
+        self.alert_at = np.array([float(row.get("AlertAt") or 1.0) for row in rows], dtype=np.float64)
+        missing = len(spend.rows)
+        self.rows = np.array(
+            [spend.rows.get((SCOPES[scope], value), missing) for scope, value in zip(self.scope, self.values)],
+            dtype=np.int64,
+        )
+
+
+def load_rules(spend, path=None):
+    """Compile the rules file against a spend table."""
+    with open(path or budget_rules_path(), newline="") as f:
+        return CompiledRules(list(csv.DictReader(f)), spend)
+
+
+class SpendTable:
+    """Spend per scope value, one row per (scope, value), columns daily/MTD/forecast.
+
+    Values of all scopes share one matrix so every rule is answered by a
+    single fancy-indexing gather, whatever its scope.
+    """
+
+    def __init__(self, as_of):
+        self.as_of = as_of
+        self.rows = {}  # (scope, value) -> row
+        self.blocks = []
+
+    def add(self, scope, keys, daily, mtd):
+        """Add per-series spend, summed into the scope values given by keys (one key per series)."""
+        values, codes = np.unique(np.asarray(keys, dtype=object), return_inverse=True) if len(keys) else ([], [])
+        elapsed = self.as_of.day
+        days_in_month = calendar.monthrange(self.as_of.year, self.as_of.month)[1]
+        block = np.zeros((len(values), len(PERIODS)))
+        if len(values):
+            block[:, 0] = np.bincount(codes, weights=daily, minlength=len(values))
+            block[:, 1] = np.bincount(codes, weights=mtd, minlength=len(values))
+            block[:, 2] = block[:, 1] / elapsed * days_in_month
+        offset = len(self.rows)
+        for i, value in enumerate(values):
+            self.rows[scope, value] = offset + i
+        self.blocks.append(block)
+
+    def matrix(self):
+        # The last row is all zeros, for rules whose scope value has no spend
+        return np.vstack(self.blocks + [np.zeros((1, len(PERIODS)))])
+
+
+def load_spend(as_of, rollup_db=None, tag_index=None):
+    """Spend of the month up to as_of from the BUDGET_PROVIDERS facts and, if present, the tag index."""
+    month_start = as_of.replace(day=1)
+    table = SpendTable(as_of)
+
+    providers = budget_providers()
+    conn = connect_rollups(rollup_db)
+    try:
+        facts = conn.execute(
+            "SELECT account, service, day, cost FROM facts WHERE day >= ? AND day <= ? "
+            f"AND provider IN ({', '.join('?' * len(providers))})",
+            [month_start.isoformat(), as_of.isoformat()] + providers,
+        ).fetchall()
+    finally:
+        conn.close()
+    accounts = [fact[0] for fact in facts]
+    services = [fact[1] for fact in facts]
+    cost = np.array([fact[3] for fact in facts], dtype=np.float64) / COST_SCALE
+    daily = np.where(np.array([fact[2] for fact in facts], dtype=object) == as_of.isoformat(), cost, 0.0)
+    table.add("total", [""] * len(facts), daily, cost)
+    table.add("account", accounts, daily, cost)
+    table.add("service", services, daily, cost)
+    table.add("account_service", [f"{a}|{s}" for a, s in zip(accounts, services)], daily, cost)
+
+    index_path = tag_index or tag_index_path()
+    if os.path.exists(index_path):
+        index = TagIndex.load(index_path)
+        columns = index.columns(month_start, as_of)
+        mtd = index.matrix[:, columns].sum(axis=1)
+        last = as_of.toordinal() - (index.start_day or 0)
+        daily = index.matrix[:, last] if 0 <= last < index.matrix.shape[1] else np.zeros(len(index.series))
+        keys = [f"{tag_key}={tag_value}" for _, _, tag_key, tag_value in index.series]
+        table.add("tag", keys, daily, mtd)
+    return table
+
+
+def evaluate(rules, spend):
+    """Evaluate every rule in one vectorized pass; returns (breached rule indexes, spend per rule).
+
+    A rule is breached when there is spend and it reaches the alert
+    threshold, so scopes without spend never alert, even with a zero limit.
+    """
+    values = spend.matrix()[rules.rows, rules.period]
+    breached = np.nonzero((values > 0) & (values >= rules.limit * rules.alert_at))[0]
+    return breached, values
+
+
+def evaluate_budgets(as_of=None, rules_path=None):
+    """Check the budget rules against the latest costs and write the breaches to the alerts report."""
+    if as_of is None:
+        providers = budget_providers()
+        conn = connect_rollups()
+        try:
+            (latest,) = conn.execute(
+                f"SELECT MAX(day) FROM facts WHERE provider IN ({', '.join('?' * len(providers))})", providers
+            ).fetchone()
+        finally:
+            conn.close()
+        as_of = date.fromisoformat(latest) if latest else date.today()
+
+    spend = load_spend(as_of)
+    rules = load_rules(spend, rules_path)
+    breached, values = evaluate(rules, spend)
+    path = write_csv(
+        ALERTS_REPORT,
+        ["AsOf", "RuleID", "Scope", "Value", "Period", "Limit", "Spend", "PercentOfLimit"],
+        (
+            [
+                as_of.isoformat(), rules.ids[i], SCOPES[rules.scope[i]], rules.values[i], PERIODS[rules.period[i]],
+                rules.limit[i], round(float(values[i]), 2),
+                round(float(values[i] / rules.limit[i] * 100), 1) if rules.limit[i] else "",
+            ]
+            for i in breached
+        ),
+    )
+    print(f"{len(breached)} of {len(rules.ids)} budget rules breached as of {as_of}; alerts written to {path}")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check spend against budget rules")
+    parser.add_argument("--rules", default=None, help="rules CSV (default: BUDGET_RULES_PATH)")
+    parser.add_argument("--as-of", type=date.fromisoformat, default=None, help="default: latest collected day")
+    args = parser.parse_args()
+    evaluate_budgets(args.as_of, args.rules)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+from datetime import datetime, timezone
+from output_sink import atomic_open, output_path, state_path
+
+# Settings are read when called, after the calling report has loaded its .env
+#   CHANGE_DETECTION        true to diff every report against its last snapshot
+#   CHANGE_SNAPSHOT_PATH    SQLite file holding the snapshots and restatement history
+#   UPLOAD_DELTAS_ONLY      true to upload only delta files and the restatement report
+DELTA_SUFFIX = ".delta"
+RESTATEMENT_REPORT = "cost-restatements.csv"
+
+# Header names of the cost column and the date/hour column, across all reports
+COST_COLUMNS = ("Cost", "PreTaxCost", "CostUSD")
+DATE_COLUMNS = ("Date", "UsageDate", "UsageDateTime", "Hour")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshot (
+    report TEXT NOT NULL,
+    key INTEGER NOT NULL,
+    row_hash INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    cost REAL NOT NULL,
+    row TEXT NOT NULL,
+    PRIMARY KEY (report, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS restatements (
+    detected_at TEXT NOT NULL,
+    report TEXT NOT NULL,
+    date TEXT NOT NULL,
+    inserted INTEGER NOT NULL,
+    updated INTEGER NOT NULL,
+    deleted INTEGER NOT NULL,
+    old_cost REAL NOT NULL,
+    new_cost REAL NOT NULL
+);
+"""
+
+
+def change_detection_enabled():
+    return os.getenv("CHANGE_DETECTION", "false").lower() == "true"
+
+
+def upload_deltas_only():
+    return os.getenv("UPLOAD_DELTAS_ONLY", "false").lower() == "true"
+
+
+def snapshot_path():
+    return state_path("CHANGE_SNAPSHOT_PATH", "snapshots.sqlite")
+
+
+def delta_filename(filename):
+    """x.csv -> x.delta.csv"""
+    root, ext = os.path.splitext(filename)
+    return f"{root}{DELTA_SUFFIX}{ext}"
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or snapshot_path(), timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _hash(values):
+    """Signed 64-bit hash of a row's values, stable across runs and processes."""
+    digest = hashlib.blake2b("\x1f".join(map(str, values)).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def _encode_row(row):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue().rstrip("\r\n")
+
+
+def _decode_row(text):
+    return next(csv.reader([text]))
+
+
+class ChangeTracker:
+    """Diffs the rows of one report against the snapshot from its previous run.
+
+    A row's identity is every value except the cost, including values
+    beyond the header (some reports append a Currency column), so a
+    changed cost for the same (date, dimensions) is an update. Rows that
+    repeat an identity within one report are numbered by occurrence, so
+    an identical re-run matches them one to one. Rows missing from the
+    new report are deletes only if their date falls inside the range the
+    new report covers; older rows have simply left the query window.
+    Changes to dates the snapshot already had are restatements.
+
+    Reports without a date column (e.g. the budget alerts) are a full
+    replacement each run: every missing row is a delete. Restatements are
+    only tracked for reports that have both a date and a cost column.
+    """
+
+    def __init__(self, report, header, conn):
+        self.report = report
+        self.header = list(header)
+        self.conn = conn
+        self.cost_index = next((i for i, name in enumerate(self.header) if name in COST_COLUMNS), None)
+        self.date_index = next((i for i, name in enumerate(self.header) if name in DATE_COLUMNS), None)
+        self.tracks_restatements = self.date_index is not None and self.cost_index is not None
+
+        # key -> (row hash, date, cost); row text is only read back for deletes
+        self.old = {
+            key: (row_hash, date, cost)
+            for key, row_hash, date, cost in conn.execute(
+                "SELECT key, row_hash, date, cost FROM snapshot WHERE report = ?", (report,)
+            )
+        }
+        self.old_dates = {date for _, date, _ in self.old.values()}
+        self.seen = set()
+        self.occurrences = {}  # identity hash -> rows seen with it
+        self.duplicates = 0
+        self.first_date = self.last_date = None
+        self.changes = []  # (op, row)
+        self.upserts = []
+        self.restated = {}
+
+    def _restate(self, date, op, old_cost=0, new_cost=0):
+        if not self.tracks_restatements or date not in self.old_dates:
+            return
+        counts = self.restated.setdefault(date, {"I": 0, "U": 0, "D": 0, "old": 0, "new": 0})
+        counts[op] += 1
+        counts["old"] += old_cost
+        counts["new"] += new_cost
+
+    def add(self, row):
+        row = ["" if value is None else value for value in row]
+        identity = [value for i, value in enumerate(row) if i != self.cost_index]
+        key = _hash(identity)
+        occurrence = self.occurrences.get(key, 0)
+        self.occurrences[key] = occurrence + 1
+        if occurrence:
+            self.duplicates += 1
+            key = _hash(identity + [f"#{occurrence}"])
+        row_hash = _hash(row)
+        date = str(row[self.date_index]) if self.date_index is not None else ""
+        cost = float(row[self.cost_index] or 0) if self.cost_index is not None else 0.0
+        self.seen.add(key)
+        if self.first_date is None or date < self.first_date:
+            self.first_date = date
+        if self.last_date is None or date > self.last_date:
+            self.last_date = date
+
+        old = self.old.get(key)
+        if old is not None and old[0] == row_hash:
+            return
+        op = "I" if old is None else "U"
+        self.changes.append((op, row))
+        self.upserts.append((self.report, key, row_hash, date, cost, _encode_row(row)))
+        self._restate(date, op, 0 if old is None else old[2], cost)
+
+    def finish(self):
+        """Collect deletes; returns the number of changed rows."""
+        self.deletes = []
+        for key, (_, date, cost) in self.old.items():
+            if key in self.seen:
+                continue
+            if self.date_index is None or (
+                self.first_date is not None and self.first_date <= date <= self.last_date
+            ):
+                self.deletes.append(key)
+                self._restate(date, "D", cost, 0)
+        for key in self.deletes:
+            (text,) = self.conn.execute(
+                "SELECT row FROM snapshot WHERE report = ? AND key = ?", (self.report, key)
+            ).fetchone()
+            self.changes.append(("D", _decode_row(text)))
+        return len(self.changes)
+
+    def commit(self):
+        """Store the new snapshot and the restatements found in this run."""
+        detected_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany("INSERT OR REPLACE INTO snapshot VALUES (?, ?, ?, ?, ?, ?)", self.upserts)
+            self.conn.executemany(
+                "DELETE FROM snapshot WHERE report = ? AND key = ?",
+                [(self.report, key) for key in self.deletes],
+            )
+            self.conn.executemany(
+                "INSERT INTO restatements VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (detected_at, self.report, date, c["I"], c["U"], c["D"], c["old"], c["new"])
+                    for date, c in sorted(self.restated.items())
+                ],
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+
+def write_restatement_report(conn):
+    """Rewrite the restatement report from the full history: one row per report, date and run."""
+    with atomic_open(RESTATEMENT_REPORT) as f:
+        writer = csv.writer(f)
+        writer.writerow(["DetectedAt", "Report", "Date", "Inserted", "Updated", "Deleted",
+                         "OldCost", "NewCost", "Restated"])
+        for detected_at, report, date, inserted, updated, deleted, old_cost, new_cost in conn.execute(
+            "SELECT * FROM restatements ORDER BY detected_at, report, date"
+        ):
+            writer.writerow([detected_at, report, date, inserted, updated, deleted,
+                             round(old_cost, 6), round(new_cost, 6), round(new_cost - old_cost, 6)])
+    return f.final_path
+
+
+def write_csv(filename, header, rows):
+    """Write a CSV report atomically and, with CHANGE_DETECTION, its delta file.
+
+    The delta file (x.delta.csv) holds the inserted, updated and removed
+    rows, prefixed with an Op column (I, U or D). It is only written when
+    something changed, and removed otherwise. With UPLOAD_DELTAS_ONLY the full report is written
+    but not queued for upload. Returns the published path of the full report.
+    """
+    if not change_detection_enabled():
+        with atomic_open(filename) as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+        return f.final_path
+
+    conn = connect()
+    try:
+        tracker = ChangeTracker(filename, header, conn)
+        with atomic_open(filename, publish=not upload_deltas_only()) as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                tracker.add(row)
+
+        if tracker.duplicates:
+            print(f"{filename}: {tracker.duplicates} rows repeat the dimensions of an earlier row")
+        if tracker.finish():
+            with atomic_open(delta_filename(filename)) as delta:
+                writer = csv.writer(delta)
+                writer.writerow(["Op"] + list(header))
+                for op, row in tracker.changes:
+                    writer.writerow([op] + list(row))
+            print(f"{len(tracker.changes)} changed rows written to {delta.final_path}")
+        else:
+            # A delta left over from an earlier run must not be uploaded again
+            stale = output_path(delta_filename(filename))
+            if os.path.exists(stale):
+                os.remove(stale)
+            print(f"No changes in {filename} since the last run")
+
+        tracker.commit()
+        if tracker.restated:
+            print(f"{filename}: costs restated for {len(tracker.restated)} previously reported days")
+            write_restatement_report(conn)
+    finally:
+        conn.close()
+    return f.final_path
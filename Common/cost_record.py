@@ -0,0 +1,134 @@
+import sys
+from datetime import date, datetime
+from change_detection import write_csv
+
+# Costs are stored as integers in millionths of the currency unit
+COST_SCALE = 1_000_000
+
+_EPOCH_DAY = date(1970, 1, 1).toordinal()
+_when_cache = {}
+
+
+def intern(value):
+    """Return a shared copy of a dimension value, so repeated strings cost one object."""
+    if value is None:
+        return ""
+    return sys.intern(str(value))
+
+
+def parse_when(value):
+    """Return (day ordinal, hour or None) for any date form the providers return.
+
+    Accepts Cost Management UsageDate integers (20250226), ISO dates
+    (2025-02-26), ISO timestamps (2025-02-26T13:00:00Z) and date objects.
+    """
+    if isinstance(value, datetime):
+        return value.toordinal(), value.hour
+    if isinstance(value, date):
+        return value.toordinal(), None
+    parsed = _when_cache.get(value)
+    if parsed is None:
+        if isinstance(value, int):
+            parsed = date(value // 10000, value // 100 % 100, value % 100).toordinal(), None
+        elif "T" in value:
+            moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            parsed = moment.toordinal(), moment.hour
+        else:
+            parsed = date.fromisoformat(value).toordinal(), None
+        _when_cache[value] = parsed
+    return parsed
+
+
+def to_fixed(amount):
+    """Convert a cost amount (string, float or int) to fixed-point micro-units."""
+    return round(float(amount) * COST_SCALE)
+
+
+class CostRecord:
+    """One cost amount for a provider, account, service and day (or hour).
+
+    Dimension values are interned, the day is a date ordinal and the cost
+    is a fixed-point integer, so records are small and later stages never
+    re-parse strings. Report-specific dimensions (instance type, resource
+    ID, ...) go in extra as a tuple.
+    """
+
+    __slots__ = ("provider", "payer", "account", "account_name", "service",
+                 "day", "hour", "cost", "currency", "extra")
+
+    def __init__(self, provider, account, service, when, amount,
+                 payer="", account_name="", currency="USD", extra=()):
+        self.provider = intern(provider)
+        self.payer = intern(payer)
+        self.account = intern(account)
+        self.account_name = intern(account_name)
+        self.service = intern(service)
+        self.day, self.hour = parse_when(when)
+        self.cost = to_fixed(amount)
+        self.currency = intern(currency)
+        self.extra = tuple(intern(value) for value in extra)
+
+    @property
+    def amount(self):
+        return self.cost / COST_SCALE
+
+    @property
+    def date(self):
+        """ISO date, as used in the AWS reports."""
+        return date.fromordinal(self.day).isoformat()
+
+    @property
+    def usage_date(self):
+        """YYYYMMDD integer, as used in the Azure reports."""
+        day = date.fromordinal(self.day)
+        return day.year * 10000 + day.month * 100 + day.day
+
+    @property
+    def epoch_hour(self):
+        return (self.day - _EPOCH_DAY) * 24 + (self.hour or 0)
+
+    def __repr__(self):
+        return (f"CostRecord({self.provider!r}, {self.account!r}, {self.service!r}, "
+                f"{self.date!r}, {self.amount!r}, extra={self.extra!r})")
+
+
+# Column names the Cost Management query API uses for cost and currency
+_AZURE_COST_COLUMNS = ("PreTaxCost", "Cost", "CostUSD")
+
+
+def records_from_azure_response(data, account, account_name=""):
+    """Convert a Cost Management query response into CostRecords.
+
+    Columns are located by name rather than position. Grouping columns
+    other than ServiceName and Currency are kept in extra, in response order.
+    """
+    properties = data.get("properties", {})
+    columns = [column["name"] for column in properties.get("columns", [])]
+    cost_index = next((columns.index(name) for name in _AZURE_COST_COLUMNS if name in columns), 0)
+    date_index = next((i for i, name in enumerate(columns) if name.startswith("UsageDate")), 1)
+    service_index = columns.index("ServiceName") if "ServiceName" in columns else None
+    currency_index = columns.index("Currency") if "Currency" in columns else None
+    known = {cost_index, date_index, service_index, currency_index}
+    extra_indexes = [i for i in range(len(columns)) if i not in known]
+
+    records = []
+    for row in properties.get("rows", []):
+        records.append(CostRecord(
+            "azure",
+            account,
+            row[service_index] if service_index is not None else "",
+            row[date_index],
+            row[cost_index],
+            account_name=account_name,
+            currency=row[currency_index] if currency_index is not None else "USD",
+            extra=[row[i] for i in extra_indexes],
+        ))
+    return records
+
+
+def write_records_csv(filename, header, records, make_row):
+    """Write records to the report filename; make_row(record) builds each CSV row.
+
+    Returns the published path (see change_detection.write_csv).
+    """
+    return write_csv(filename, header, (make_row(record) for record in records))
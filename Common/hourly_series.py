@@ -0,0 +1,87 @@
+import os
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+from change_detection import write_csv
+
+
+# Settings are read when called, after the calling report has loaded its .env
+def cost_granularity():
+    """DAILY unless COST_GRANULARITY=HOURLY is set."""
+    return os.getenv("COST_GRANULARITY", "DAILY").upper()
+
+
+def hourly_mode():
+    return cost_granularity() == "HOURLY"
+
+
+def warn_daily_only():
+    """Print a notice when COST_GRANULARITY=HOURLY is set for a report that only has daily data."""
+    if hourly_mode():
+        print("COST_GRANULARITY=HOURLY only applies to the AWS Cost Explorer reports; "
+              "the Cost Management query API returns daily data.")
+
+
+def hourly_window(days=None):
+    """Return (start, end) UTC datetimes aligned to the hour, ending at the current hour.
+
+    AWS Cost Explorer keeps hourly data for 14 days, the default window.
+    """
+    if days is None:
+        days = int(os.getenv("HOURLY_WINDOW_DAYS", "14"))
+    end = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return end - timedelta(days=days), end
+
+
+class HourlySeriesStore:
+    """Hourly cost series stored as fixed-width float arrays.
+
+    Each series is identified by a tuple of interned dimension values and
+    holds one double per hour of the window, indexed by the hour offset
+    from the window start. Fourteen days take 336 * 8 bytes per series.
+    """
+
+    def __init__(self, start, end):
+        self.start = start
+        self.hours = int((end - start).total_seconds() // 3600)
+        self._start_hour = int(start.timestamp()) // 3600
+        self._empty = array("d", bytes(8 * self.hours))
+        self._series = {}
+
+    def _add_at(self, key, offset, cost):
+        key = tuple(key)
+        series = self._series.get(key)
+        if series is None:
+            key = tuple(sys.intern(value) if isinstance(value, str) else value for value in key)
+            series = self._series.setdefault(key, array("d", self._empty))
+        series[offset] += cost
+
+    def add_record(self, key, record):
+        """Add a CostRecord's amount to the series for key at the record's hour."""
+        offset = record.epoch_hour - self._start_hour
+        if not 0 <= offset < self.hours:
+            return
+        self._add_at(key, offset, record.amount)
+
+    def __len__(self):
+        return len(self._series)
+
+    def keys(self):
+        return self._series.keys()
+
+    def series(self, key):
+        return self._series[key]
+
+    def timestamp(self, offset):
+        return (self.start + timedelta(hours=offset)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def iter_rows(self):
+        """Yield (key, timestamp, cost) for every non-zero hour of every series."""
+        for key, series in self._series.items():
+            for offset, cost in enumerate(series):
+                if cost:
+                    yield key, self.timestamp(offset), cost
+
+    def write_csv(self, filename, header, make_row):
+        """Write the store to the report filename; make_row(key, timestamp, cost) builds each CSV row."""
+        return write_csv(filename, header, (make_row(key, timestamp, cost) for key, timestamp, cost in self.iter_rows()))
@@ -0,0 +1,318 @@
+import glob
+import gzip
+import io
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# Settings are read when called, after the calling report has loaded its .env
+#   OUTPUT_DIR          directory reports are written to (default: current directory)
+#   OUTPUT_COMPRESSION  none, gzip or zstd
+#   OUTPUT_BACKENDS     where upload_to_drive.py sends reports: drive, s3, local
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+# Repository root; local state shared by the AWS and Azure reports lives here by default
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_active_uploads = None
+_upload_target = threading.local()
+
+
+def state_path(env_var, filename):
+    """Path of a local state file: env_var if set, else filename in the repository root.
+
+    Reports run from AWS/ and Azure/, so a relative default would give
+    each cloud its own copy.
+    """
+    return os.getenv(env_var) or os.path.join(ROOT, filename)
+
+
+def output_dir():
+    return os.getenv("OUTPUT_DIR", ".")
+
+
+def output_compression():
+    compression = os.getenv("OUTPUT_COMPRESSION", "none").lower()
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unsupported OUTPUT_COMPRESSION: {compression}")
+    return compression
+
+
+def output_path(filename, compression=None):
+    """Final path of a report: inside OUTPUT_DIR, with the compression suffix."""
+    compression = compression or output_compression()
+    return os.path.join(output_dir(), filename) + COMPRESSION_SUFFIXES[compression]
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("OUTPUT_COMPRESSION=zstd requires the zstandard package")
+    return zstandard
+
+
+@contextmanager
+def atomic_open(filename, compression=None, publish=True):
+    """Open a report for writing as text, publishing it only once it is complete.
+
+    Data goes to a hidden temp file next to the final path, which is
+    flushed, fsynced and renamed over the final path on success. A crash
+    or exception leaves any previous report untouched and no partial file
+    behind. The context value is the text stream; its .final_path
+    attribute holds the published path. With publish=False the file is
+    not handed to the active UploadQueue.
+    """
+    compression = compression or output_compression()
+    path = output_path(filename, compression)
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            if compression == "gzip":
+                stream = gzip.GzipFile(filename=os.path.basename(filename), mode="wb", fileobj=raw)
+            elif compression == "zstd":
+                stream = _zstandard().ZstdCompressor(level=int(os.getenv("ZSTD_LEVEL", "6"))).stream_writer(
+                    raw, closefd=False
+                )
+            else:
+                stream = None
+            text = io.TextIOWrapper(stream or raw, encoding="utf-8", newline="")
+            text.final_path = path
+            yield text
+            text.flush()
+            text.detach()
+            if stream is not None:
+                stream.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if publish:
+        published(path)
+
+
+def published(path):
+    """Hand a completed report to the active UploadQueue, if any, and return its path."""
+    uploads = _active_uploads
+    if uploads is not None:
+        uploads.put(
+            path,
+            getattr(_upload_target, "folder_structure", None),
+            getattr(_upload_target, "backends", None),
+        )
+    return path
+
+
+@contextmanager
+def upload_folder(folder_structure, backends=None):
+    """Upload reports completed by the current thread to folder_structure instead of the queue default.
+
+    backends, if given, replaces the queue's backends for these reports,
+    e.g. to send each cloud's reports to its own Drive folder.
+    """
+    previous = (getattr(_upload_target, "folder_structure", None), getattr(_upload_target, "backends", None))
+    _upload_target.folder_structure = folder_structure
+    _upload_target.backends = backends
+    try:
+        yield
+    finally:
+        _upload_target.folder_structure, _upload_target.backends = previous
+
+
+def find_reports(directory=None):
+    """Completed reports in directory; in-progress writes are hidden .tmp files and never match.
+
+    With UPLOAD_DELTAS_ONLY only delta files and the restatement report
+    are returned, otherwise delta files are left out.
+    """
+    directory = directory or output_dir()
+    deltas_only = os.getenv("UPLOAD_DELTAS_ONLY", "false").lower() == "true"
+    reports = []
+    for suffix in COMPRESSION_SUFFIXES.values():
+        for path in glob.glob(os.path.join(directory, f"*.csv{suffix}")):
+            is_delta = path.endswith(f".delta.csv{suffix}")
+            if is_delta == deltas_only or os.path.basename(path).startswith("cost-restatements.csv"):
+                reports.append(path)
+    return sorted(reports)
+
+
+class LocalDirectoryBackend:
+    """Copies reports into directory/<folder structure>/."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def upload(self, path, folder_structure):
+        target_dir = os.path.join(self.directory, folder_structure)
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, os.path.basename(path))
+        fd, tmp_path = tempfile.mkstemp(dir=target_dir, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, target)
+        print(f"Copied {path} to {target}.")
+
+
+class S3Backend:
+    """Uploads reports to an S3 bucket or an S3-compatible stand-in (endpoint_url, e.g. MinIO)."""
+
+    def __init__(self, bucket, endpoint_url=None):
+        import boto3
+
+        self.bucket = bucket
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            region_name=os.getenv("AWS_DEFAULT_REGION"),
+        )
+
+    def upload(self, path, folder_structure):
+        key = f"{folder_structure}/{os.path.basename(path)}"
+        self._client.upload_file(path, self.bucket, key)
+        print(f"Uploaded {path} to s3://{self.bucket}/{key}.")
+
+
+class DriveBackend:
+    """Uploads reports to Google Drive under root_folder_id/<folder structure>.
+
+    Drive services are not thread-safe, so each upload thread builds its
+    own; folder IDs are looked up once and shared.
+    """
+
+    MIMETYPES = {".gz": "application/gzip", ".zst": "application/zstd", ".csv": "text/csv"}
+
+    def __init__(self, root_folder_id, service_account_file):
+        self.root_folder_id = root_folder_id
+        self.service_account_file = service_account_file
+        self._local = threading.local()
+        self._folders = {}
+        self._folder_lock = threading.Lock()
+
+    def _service(self):
+        service = getattr(self._local, "service", None)
+        if service is None:
+            from googleapiclient.discovery import build
+            from google.oauth2.service_account import Credentials
+
+            creds = Credentials.from_service_account_file(self.service_account_file)
+            service = self._local.service = build("drive", "v3", credentials=creds)
+        return service
+
+    def _folder_id(self, folder_structure):
+        with self._folder_lock:
+            folder_id = self._folders.get(folder_structure)
+            if folder_id is not None:
+                return folder_id
+
+            # Create folders if not present
+            service = self._service()
+            folder_id = self.root_folder_id
+            for folder in folder_structure.split("/"):
+                query = f"'{folder_id}' in parents and name='{folder}' and mimeType='application/vnd.google-apps.folder'"
+                results = service.files().list(q=query, spaces="drive").execute()
+                folders = results.get("files", [])
+                if folders:
+                    folder_id = folders[0]["id"]
+                else:
+                    file_metadata = {
+                        "name": folder,
+                        "mimeType": "application/vnd.google-apps.folder",
+                        "parents": [folder_id],
+                    }
+                    folder = service.files().create(body=file_metadata, fields="id").execute()
+                    folder_id = folder.get("id")
+            self._folders[folder_structure] = folder_id
+            return folder_id
+
+    def upload(self, path, folder_structure):
+        from googleapiclient.http import MediaFileUpload
+
+        folder_id = self._folder_id(folder_structure)
+        file_metadata = {"name": os.path.basename(path), "parents": [folder_id]}
+        mimetype = self.MIMETYPES.get(os.path.splitext(path)[1], "application/octet-stream")
+        media = MediaFileUpload(path, mimetype=mimetype, resumable=True)
+        self._service().files().create(body=file_metadata, media_body=media, fields="id").execute()
+        print(f"Uploaded {path} to Google Drive.")
+
+
+def backends_from_env(settings=None):
+    """Build the upload backends listed in OUTPUT_BACKENDS (default: drive).
+
+    Settings are read from the environment, or from settings (a mapping
+    such as one cloud's .env values) when given.
+    """
+    get = os.getenv if settings is None else settings.get
+    backends = []
+    for name in (get("OUTPUT_BACKENDS") or "drive").split(","):
+        name = name.strip().lower()
+        if name == "drive":
+            backends.append(DriveBackend(get("GOOGLE_DRIVE_FOLDER_ID"), get("SERVICE_ACCOUNT_FILE")))
+        elif name == "s3":
+            backends.append(S3Backend(get("OUTPUT_S3_BUCKET"), get("OUTPUT_S3_ENDPOINT")))
+        elif name == "local":
+            backends.append(LocalDirectoryBackend(get("OUTPUT_ARCHIVE_DIR") or "archive"))
+        elif name:
+            raise ValueError(f"Unknown output backend: {name}")
+    return backends
+
+
+class UploadQueue:
+    """Uploads reports to every backend from worker threads fed by a bounded queue.
+
+    While the queue is open, every report completed by atomic_open is
+    queued automatically, so uploads overlap with writing the next report;
+    writers block once UPLOAD_QUEUE_SIZE reports are waiting.
+    """
+
+    def __init__(self, backends, folder_structure=None, maxsize=None, workers=None):
+        self.backends = backends
+        self.folder_structure = folder_structure
+        self.failed = []
+        self._queue = queue.Queue(maxsize=maxsize or int(os.getenv("UPLOAD_QUEUE_SIZE", "8")))
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(workers or int(os.getenv("UPLOAD_WORKERS", "4")))
+        ]
+
+    def put(self, path, folder_structure=None, backends=None):
+        self._queue.put((path, folder_structure or self.folder_structure, backends or self.backends))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, folder_structure, backends = item
+            for backend in backends:
+                try:
+                    backend.upload(path, folder_structure)
+                except Exception as e:
+                    print(f"Error while uploading {path} with {type(backend).__name__}: {e}")
+                    self.failed.append((path, backend))
+
+    def __enter__(self):
+        global _active_uploads
+        for thread in self._threads:
+            thread.start()
+        _active_uploads = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active_uploads
+        _active_uploads = None
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        return False
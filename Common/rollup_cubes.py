@@ -0,0 +1,235 @@
+import argparse
+import os
+import sqlite3
+import sys
+from datetime import date, timedelta
+from cost_record import COST_SCALE
+from output_sink import state_path
+
+# Time grains and dimensions the dashboards read. Every cube cell is keyed
+# by (grain, dimension, period start, provider, account, service); dimensions
+# that a cell does not break down by are stored as "".
+GRAINS = ("day", "week", "month", "year")
+DIMENSIONS = ("total", "account", "service", "account_service")
+# Every feed writes facts under its own provider. Feeds that name services
+# or measure cost differently then never replace each other's facts:
+#   aws           Cost Explorer: UnblendedCost, Cost Explorer service names
+#   aws-cur       Cost and Usage Report: unblended cost, product codes
+#   azure         Cost Management query API: Usage, PreTaxCost
+#   azure-export  Cost Management exports: CostInBillingCurrency, meter categories
+PROVIDERS = ("aws", "aws-cur", "azure", "azure-export")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS facts (
+    provider TEXT NOT NULL,
+    account TEXT NOT NULL,
+    service TEXT NOT NULL,
+    day TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    PRIMARY KEY (provider, account, day, service)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cube (
+    grain TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    period TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    account TEXT NOT NULL,
+    service TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    PRIMARY KEY (grain, dimension, period, provider, account, service)
+) WITHOUT ROWID;
+"""
+
+_UPSERT_CELL = """
+INSERT INTO cube VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (grain, dimension, period, provider, account, service)
+DO UPDATE SET cost = cost + excluded.cost
+"""
+
+_DELETE_EMPTY_CELL = """
+DELETE FROM cube
+WHERE grain = ? AND dimension = ? AND period = ? AND provider = ? AND account = ? AND service = ? AND cost = 0
+"""
+
+
+def rollup_db_path():
+    return state_path("ROLLUP_DB_PATH", "rollups.sqlite")
+
+
+def connect(path=None):
+    path = path or rollup_db_path()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def period_start(day, grain):
+    """First day of the period of the given grain containing day (a date)."""
+    if grain == "day":
+        return day
+    if grain == "week":
+        return day - timedelta(days=day.weekday())
+    if grain == "month":
+        return day.replace(day=1)
+    if grain == "year":
+        return day.replace(month=1, day=1)
+    raise ValueError(f"Unknown grain: {grain}")
+
+
+def _cells(provider, account, service, day):
+    """Every cube cell a fact for (provider, account, service, day) contributes to."""
+    day = date.fromisoformat(day)
+    for grain in GRAINS:
+        period = period_start(day, grain).isoformat()
+        yield grain, "total", period, provider, "", ""
+        yield grain, "account", period, provider, account, ""
+        yield grain, "service", period, provider, "", service
+        yield grain, "account_service", period, provider, account, service
+
+
+def update_rollups(records, path=None):
+    """Fold daily CostRecords into the rollup cubes, touching only affected cells.
+
+    The records replace what is stored for each (provider, account, day)
+    they cover: services that disappeared from a restated day are removed.
+    Only the difference between the old and new facts is added to the
+    cube cells, so a run that restates two days updates those days' cells
+    and their week, month and year cells, nothing else. Cells left at
+    zero are deleted, so a service that disappeared is not reported at
+    0.0. Returns the number of facts that changed.
+    """
+    new = {}
+    for record in records:
+        key = (record.provider, record.account, record.service, record.date)
+        new[key] = new.get(key, 0) + record.cost
+    if not new:
+        return 0
+    scopes = {(provider, account, day) for provider, account, _, day in new}
+
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        old = {}
+        for provider, account, day in scopes:
+            for service, cost in conn.execute(
+                "SELECT service, cost FROM facts WHERE provider = ? AND account = ? AND day = ?",
+                (provider, account, day),
+            ):
+                old[provider, account, service, day] = cost
+
+        deltas = {}
+        changed = []
+        removed = []
+        for key in new.keys() | old.keys():
+            delta = new.get(key, 0) - old.get(key, 0)
+            if not delta and key in old:
+                continue
+            if key in new:
+                changed.append(key + (new[key],))
+            else:
+                removed.append(key)
+            for cell in _cells(*key):
+                deltas[cell] = deltas.get(cell, 0) + delta
+
+        conn.executemany("INSERT OR REPLACE INTO facts (provider, account, service, day, cost) VALUES (?, ?, ?, ?, ?)", changed)
+        conn.executemany("DELETE FROM facts WHERE provider = ? AND account = ? AND service = ? AND day = ?", removed)
+        changed_cells = [cell for cell, delta in deltas.items() if delta]
+        conn.executemany(_UPSERT_CELL, [cell + (deltas[cell],) for cell in changed_cells])
+        conn.executemany(_DELETE_EMPTY_CELL, changed_cells)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return len(changed) + len(removed)
+
+
+def rebuild(path=None):
+    """Recompute every cube cell from the stored facts, e.g. after adding a grain."""
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM cube")
+        totals = {}
+        for provider, account, service, day, cost in conn.execute(
+            "SELECT provider, account, service, day, cost FROM facts"
+        ):
+            for cell in _cells(provider, account, service, day):
+                totals[cell] = totals.get(cell, 0) + cost
+        conn.executemany(_UPSERT_CELL, [cell + (cost,) for cell, cost in totals.items()])
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def read_cube(grain, dimension, start=None, end=None, provider=None, path=None):
+    """Rows (period, provider, account, service, cost) for periods starting in [start, end]."""
+    if grain not in GRAINS or dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown cube: {grain} by {dimension}")
+    query = "SELECT period, provider, account, service, cost FROM cube WHERE grain = ? AND dimension = ?"
+    params = [grain, dimension]
+    if start is not None:
+        query += " AND period >= ?"
+        params.append(period_start(start, grain).isoformat())
+    if end is not None:
+        query += " AND period <= ?"
+        params.append(end.isoformat())
+    if provider is not None:
+        query += " AND provider = ?"
+        params.append(provider)
+    query += " ORDER BY period, provider, account, service"
+
+    conn = connect(path)
+    try:
+        return [row[:4] + (row[4] / COST_SCALE,) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+
+def month_to_date(dimension="total", as_of=None, provider=None, path=None):
+    """Month-to-date cost by dimension: the month cells of as_of's month (default today)."""
+    as_of = as_of or date.today()
+    return read_cube("month", dimension, as_of, as_of, provider, path)
+
+
+def year_to_date(dimension="total", as_of=None, provider=None, path=None):
+    """Year-to-date cost by dimension: the year cells of as_of's year (default today)."""
+    as_of = as_of or date.today()
+    return read_cube("year", dimension, as_of, as_of, provider, path)
+
+
+# Read the cubes from the command line, e.g.
+#   python rollup_cubes.py month account --start 2025-01-01
+#   python rollup_cubes.py --rebuild
+def main():
+    parser = argparse.ArgumentParser(description="Read the pre-aggregated cost rollups")
+    parser.add_argument("grain", nargs="?", choices=GRAINS, default="month")
+    parser.add_argument("dimension", nargs="?", choices=DIMENSIONS, default="total")
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat)
+    parser.add_argument("--provider", choices=PROVIDERS)
+    parser.add_argument("--db", default=None, help="rollup database (default: ROLLUP_DB_PATH)")
+    parser.add_argument("--rebuild", action="store_true", help="recompute all cells from the stored facts")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild(args.db)
+        return
+    for period, provider, account, service, cost in read_cube(
+        args.grain, args.dimension, args.start, args.end, args.provider, args.db
+    ):
+        print("\t".join([period, provider, account, service, f"{cost:.2f}"]))
+
+if __name__ == "__main__":
+    sys.exit(main())
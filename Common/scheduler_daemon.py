@@ -0,0 +1,170 @@
+import heapq
+import importlib.util
+import json
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dotenv import dotenv_values, load_dotenv
+from output_sink import UploadQueue, backends_from_env, upload_folder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# .env files are read once, when the daemon starts. Every report runs in
+# this one process, so settings both clouds define (the Drive folder, the
+# service account file, ...) are kept per cloud in CLOUD_SETTINGS and
+# used for that cloud's uploads; the real environment overrides both files.
+CLOUD_SETTINGS = {
+    cloud: {**dotenv_values(os.path.join(ROOT, cloud, ".env")), **os.environ}
+    for cloud in ("AWS", "Azure")
+}
+for cloud in CLOUD_SETTINGS:
+    load_dotenv(os.path.join(ROOT, cloud, ".env"))
+
+# Global limit on reports running at the same time, across both clouds
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "2"))
+SCHEDULER_DEFAULT_INTERVAL = int(os.getenv("SCHEDULER_DEFAULT_INTERVAL", str(24 * 3600)))
+SCHEDULER_DEFAULT_JITTER = int(os.getenv("SCHEDULER_DEFAULT_JITTER", str(15 * 60)))
+# Optional JSON file overriding the schedule per job:
+#   {"aws_cost_per_account": {"interval": 3600, "jitter": 300, "enabled": true}}
+SCHEDULER_CONFIG = os.getenv("SCHEDULER_CONFIG")
+SCHEDULER_UPLOADS = os.getenv("SCHEDULER_UPLOADS", "true").lower() == "true"
+
+# (cloud, script, entry point) of every report the daemon runs
+REPORTS = [
+    ("AWS", "aws_cost_per_account", "get_aws_cost_per_account"),
+    ("AWS", "aws_cost_per_service", "get_aws_cost_per_service"),
+    ("AWS", "aws_cost_per_service_per_account", "get_aws_cost_per_service_per_account"),
+    ("AWS", "aws_gpu_cost_report", "get_gpu_ec2_cost"),
+    ("AWS", "aws_cost_per_tag", "get_aws_cost_per_tag"),
+    ("Azure", "azure_cost_per_account", "main"),
+    ("Azure", "azure_cost_per_service", "main"),
+    ("Azure", "azure_cost_per_service_per_account", "main"),
+    ("Azure", "azure_cost_openAi", "main"),
+    ("Azure", "azure_cost_per_resources", "main"),
+    ("Azure", "azure_cost_per_tag", "main"),
+]
+
+
+def load_report(cloud, script):
+    """Import a report script once, so its clients, sessions and tokens stay warm between runs."""
+    directory = os.path.join(ROOT, cloud)
+    if directory not in sys.path:
+        sys.path.append(directory)
+    spec = importlib.util.spec_from_file_location(script, os.path.join(directory, f"{script}.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[script] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class Job:
+    """A report run every interval seconds, each run delayed by a random 0..jitter seconds."""
+
+    def __init__(self, name, cloud, run, interval, jitter):
+        self.name = name
+        self.cloud = cloud
+        self.run = run
+        self.interval = interval
+        self.jitter = jitter
+        self.running = False
+        self.backends = None  # upload backends built from the cloud's settings
+        self.next_run = time.time() + random.uniform(0, jitter)
+
+    def schedule_next(self):
+        self.next_run += self.interval
+        # Re-jitter every run so jobs sharing an interval do not stay aligned
+        self.next_run += random.uniform(-self.jitter / 2, self.jitter / 2)
+        self.next_run = max(self.next_run, time.time() + 1)
+
+
+def load_jobs():
+    overrides = {}
+    if SCHEDULER_CONFIG:
+        with open(SCHEDULER_CONFIG) as f:
+            overrides = json.load(f)
+
+    jobs = []
+    for cloud, script, entry_point in REPORTS:
+        settings = overrides.get(script, {})
+        if not settings.get("enabled", True):
+            continue
+        try:
+            run = getattr(load_report(cloud, script), entry_point)
+        except Exception as e:
+            print(f"Could not load {script}, it will not be scheduled: {e}")
+            continue
+        jobs.append(Job(
+            script,
+            cloud,
+            run,
+            settings.get("interval", SCHEDULER_DEFAULT_INTERVAL),
+            settings.get("jitter", SCHEDULER_DEFAULT_JITTER),
+        ))
+    return jobs
+
+
+def run_job(job):
+    today = datetime.now()
+    started = time.monotonic()
+    try:
+        with upload_folder(f"{job.cloud}/{today.year}/{today.month}/{today.day}", job.backends):
+            job.run()
+        print(f"{job.name} finished in {time.monotonic() - started:.1f}s")
+    except Exception as e:
+        print(f"{job.name} failed after {time.monotonic() - started:.1f}s: {e}")
+    finally:
+        job.running = False
+
+
+def run_forever(jobs, stop):
+    """Dispatch due jobs until stop is set.
+
+    A job whose previous run is still queued or running is skipped for
+    that slot. At most SCHEDULER_MAX_CONCURRENCY reports run at once;
+    other due jobs wait in the executor queue.
+    """
+    pending = [(job.next_run, index) for index, job in enumerate(jobs)]
+    heapq.heapify(pending)
+    with ThreadPoolExecutor(max_workers=SCHEDULER_MAX_CONCURRENCY) as executor:
+        while pending and not stop.is_set():
+            due, index = pending[0]
+            if stop.wait(max(0, due - time.time())):
+                break
+            heapq.heappop(pending)
+            job = jobs[index]
+            if job.running:
+                print(f"Skipping {job.name}: previous run still in progress")
+            else:
+                job.running = True
+                executor.submit(run_job, job)
+            job.schedule_next()
+            heapq.heappush(pending, (job.next_run, index))
+
+
+def main():
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    jobs = load_jobs()
+    for job in jobs:
+        print(f"Scheduled {job.name} every {job.interval}s (jitter {job.jitter}s)")
+
+    if SCHEDULER_UPLOADS:
+        # One long-lived queue: Drive/S3 clients and folder IDs stay cached between runs.
+        # Each job uploads through the backends of its own cloud.
+        backends = {cloud: backends_from_env(settings) for cloud, settings in CLOUD_SETTINGS.items()}
+        for job in jobs:
+            job.backends = backends[job.cloud]
+        with UploadQueue([]):
+            run_forever(jobs, stop)
+    else:
+        run_forever(jobs, stop)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import fcntl
+import json
+import os
+import sys
+import tempfile
+from datetime import date
+import numpy as np
+from cost_record import COST_SCALE
+from output_sink import state_path
+
+
+def tag_index_path():
+    return state_path("TAG_INDEX_PATH", "tag_index.npz")
+
+
+class TagIndex:
+    """Inverted index from (tag key, tag value) to daily cost series.
+
+    Every (provider, account, tag key, tag value) combination is one row
+    of a float64 matrix with one column per day, starting at start_day (a
+    date ordinal). Postings map (tag key, tag value) and account to arrays
+    of row numbers. A query is a dictionary lookup followed by a
+    vectorized sum over the selected rows and day columns.
+    """
+
+    def __init__(self):
+        self.start_day = None
+        self.matrix = np.zeros((0, 0))
+        self.series = []
+        self._series_ids = {}
+        self._tag_postings = {}
+        self._account_postings = {}
+        self._scope_postings = {}  # (provider, account, tag key) -> rows
+
+    def _series_id(self, key):
+        series_id = self._series_ids.get(key)
+        if series_id is None:
+            series_id = self._series_ids[key] = len(self.series)
+            self.series.append(key)
+            provider, account, tag_key, tag_value = key
+            self._tag_postings.setdefault((tag_key, tag_value), []).append(series_id)
+            self._account_postings.setdefault(account, []).append(series_id)
+            self._scope_postings.setdefault((provider, account, tag_key), []).append(series_id)
+        return series_id
+
+    def add_records(self, records):
+        """Upsert tagged CostRecords (extra = (tag key, tag value)).
+
+        The records replace what is stored for each (provider, account,
+        tag key, day) they cover: values that disappeared from a restated
+        day are zeroed, as update_rollups does for the facts, so
+        re-collecting a window does not double count.
+        """
+        cells = {}
+        scopes = {}
+        for record in records:
+            tag_key, tag_value = record.extra[:2]
+            series_id = self._series_id((record.provider, record.account, tag_key, tag_value))
+            cells[series_id, record.day] = cells.get((series_id, record.day), 0) + record.cost
+            scopes.setdefault((record.provider, record.account, tag_key), set()).add(record.day)
+        if not cells:
+            return
+
+        rows = np.fromiter((cell[0] for cell in cells), dtype=np.int64, count=len(cells))
+        days = np.fromiter((cell[1] for cell in cells), dtype=np.int64, count=len(cells))
+        costs = np.fromiter(cells.values(), dtype=np.float64, count=len(cells)) / COST_SCALE
+
+        self._resize(int(days.min()), int(days.max()))
+        for scope, scope_days in scopes.items():
+            scope_rows = np.asarray(self._scope_postings[scope], dtype=np.int64)
+            scope_columns = np.fromiter(scope_days, dtype=np.int64, count=len(scope_days)) - self.start_day
+            self.matrix[np.ix_(scope_rows, scope_columns)] = 0.0
+        self.matrix[rows, days - self.start_day] = costs
+
+    def _resize(self, first_day, last_day):
+        if self.start_day is None:
+            self.start_day = first_day
+        old_rows, old_days = self.matrix.shape
+        before = max(0, self.start_day - first_day)
+        after = max(0, last_day - (self.start_day + old_days - 1))
+        new_rows = len(self.series) - old_rows
+        if before or after or new_rows:
+            self.matrix = np.pad(self.matrix, ((0, new_rows), (before, after)))
+            self.start_day -= before
+
+    def _rows(self, tag_key, tag_value, accounts=None):
+        rows = np.asarray(self._tag_postings.get((tag_key, tag_value), []), dtype=np.int64)
+        if accounts is not None:
+            account_rows = [row for account in accounts for row in self._account_postings.get(account, [])]
+            rows = np.intersect1d(rows, np.asarray(account_rows, dtype=np.int64))
+        return rows
+
+    def columns(self, start, end):
+        """Column slice for the inclusive date range [start, end]."""
+        if self.start_day is None:
+            return slice(0, 0)
+        first = max(0, start.toordinal() - self.start_day)
+        last = min(self.matrix.shape[1], end.toordinal() - self.start_day + 1)
+        return slice(first, max(first, last))
+
+    def cost(self, tag_key, tag_value, start, end, accounts=None):
+        """Total cost of tag_key=tag_value between start and end (inclusive), optionally for some accounts."""
+        rows = self._rows(tag_key, tag_value, accounts)
+        return float(self.matrix[rows, self.columns(start, end)].sum())
+
+    def cost_by_account(self, tag_key, tag_value, start, end):
+        rows = self._rows(tag_key, tag_value)
+        totals = self.matrix[rows, self.columns(start, end)].sum(axis=1)
+        by_account = {}
+        for row, total in zip(rows, totals):
+            account = self.series[row][1]
+            by_account[account] = by_account.get(account, 0.0) + float(total)
+        return by_account
+
+    def cost_by_value(self, tag_key, start, end):
+        """Total cost per value of tag_key, for chargeback across all accounts."""
+        columns = self.columns(start, end)
+        return {
+            tag_value: float(self.matrix[np.asarray(rows, dtype=np.int64), columns].sum())
+            for (key, tag_value), rows in self._tag_postings.items()
+            if key == tag_key
+        }
+
+    def save(self, path=None):
+        """Write the index atomically: a temp file renamed over path."""
+        path = path or tag_index_path()
+        directory = os.path.dirname(path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    matrix=self.matrix,
+                    start_day=np.array([-1 if self.start_day is None else self.start_day]),
+                    series=np.array([json.dumps(self.series)]),
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path=None):
+        """Load the index from path, or return an empty index if it does not exist yet."""
+        path = path or tag_index_path()
+        index = cls()
+        if not os.path.exists(path):
+            return index
+        with np.load(path) as data:
+            start_day = int(data["start_day"][0])
+            index.start_day = None if start_day < 0 else start_day
+            for key in json.loads(str(data["series"][0])):
+                index._series_id(tuple(key))
+            index.matrix = data["matrix"]
+        return index
+
+
+def update_tag_index(records, path=None):
+    """Merge tagged CostRecords into the index stored at path.
+
+    The load, merge and save run under an exclusive lock on a sidecar
+    file, so the AWS and Azure tag reports can run at the same time
+    without one overwriting the other's update.
+    """
+    path = path or tag_index_path()
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            index = TagIndex.load(path)
+            index.add_records(records)
+            index.save(path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return index
+
+
+# Query the index from the command line, e.g.
+#   python tag_index.py team=platform 2025-01-01 2025-03-31 --by-account
+def main():
+    parser = argparse.ArgumentParser(description="Chargeback queries over the cost tag index")
+    parser.add_argument("tag", help="key=value, or just key for a breakdown by value")
+    parser.add_argument("start", type=date.fromisoformat)
+    parser.add_argument("end", type=date.fromisoformat)
+    parser.add_argument("--account", action="append", help="limit to these accounts")
+    parser.add_argument("--by-account", action="store_true")
+    parser.add_argument("--index", default=None, help="index file (default: TAG_INDEX_PATH)")
+    args = parser.parse_args()
+
+    index = TagIndex.load(args.index)
+    if "=" not in args.tag:
+        for tag_value, cost in sorted(index.cost_by_value(args.tag, args.start, args.end).items()):
+            print(f"{args.tag}={tag_value}\t{cost:.2f}")
+        return
+
+    tag_key, tag_value = args.tag.split("=", 1)
+    if args.by_account:
+        for account, cost in sorted(index.cost_by_account(tag_key, tag_value, args.start, args.end).items()):
+            print(f"{account}\t{cost:.2f}")
+    else:
+        print(f"{index.cost(tag_key, tag_value, args.start, args.end, args.account):.2f}")
+
+if __name__ == "__main__":
+    sys.exit(main())
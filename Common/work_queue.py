@@ -0,0 +1,333 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from cost_record import COST_SCALE, CostRecord
+from scheduler_daemon import load_report
+from output_sink import state_path
+
+# Settings (the scheduler module has already loaded AWS/.env and Azure/.env)
+#   WORK_QUEUE_PATH       SQLite file shared by every worker. It uses the rollback journal,
+#                         not WAL: WAL needs shared memory on a single host, while the
+#                         rollback journal only relies on file locks, so the file can sit
+#                         on a network filesystem whose fcntl locks work (e.g. NFSv4)
+#   WORK_LEASE_SECONDS    how long a claimed task stays reserved without a heartbeat
+#   WORK_MAX_ATTEMPTS     attempts before a task is marked failed
+WORK_LEASE_SECONDS = int(os.getenv("WORK_LEASE_SECONDS", "300"))
+WORK_MAX_ATTEMPTS = int(os.getenv("WORK_MAX_ATTEMPTS", "5"))
+
+# Reports that can be sharded: each exposes
+# get_cost_records(subscription_id, start_date, end_date) and write_reports(records)
+SHARDED_REPORTS = {
+    "azure_cost_per_account": "Azure",
+    "azure_cost_per_service": "Azure",
+    "azure_cost_per_service_per_account": "Azure",
+    "azure_cost_openAi": "Azure",
+    "azure_cost_per_tag": "Azure",
+}
+
+# A report's merge task has an empty target; it becomes claimable once none
+# of its shards are pending or leased
+MERGE = ""
+
+_reports = {}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    report TEXT NOT NULL,
+    target TEXT NOT NULL,
+    window TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    result TEXT,
+    UNIQUE (report, target, window)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, available_at);
+"""
+
+
+def work_queue_path():
+    return state_path("WORK_QUEUE_PATH", "work_queue.sqlite")
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or work_queue_path(), timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.execute("PRAGMA busy_timeout=60000")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _dump_records(records):
+    return json.dumps([
+        [r.provider, r.account, r.service, r.day, r.hour, r.cost, r.payer, r.account_name, r.currency, list(r.extra)]
+        for r in records
+    ])
+
+
+def _load_records(text):
+    records = []
+    for provider, account, service, day, hour, cost, payer, account_name, currency, extra in json.loads(text):
+        day = date.fromordinal(day)
+        when = day if hour is None else datetime(day.year, day.month, day.day, hour)
+        records.append(CostRecord(provider, account, service, when, cost / COST_SCALE,
+                                  payer=payer, account_name=account_name, currency=currency, extra=extra))
+    return records
+
+
+def make_window(start, end):
+    """Encode a task's time period as "start/end" (ISO 8601 interval)."""
+    return f"{start.isoformat()}/{end.isoformat()}"
+
+
+def parse_window(window):
+    start, end = window.split("/")
+    return datetime.fromisoformat(start), datetime.fromisoformat(end)
+
+
+def default_window(days=7):
+    """The last 7 days up to the current hour, like the single-process reports."""
+    end = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return make_window(end - timedelta(days=days), end)
+
+
+def enqueue(conn, report, targets, window):
+    """Add one task per target, plus the report's merge task; tasks already queued are kept.
+
+    window (see make_window) is the time period every shard queries, so
+    retried and re-claimed shards cover exactly the same dates.
+    """
+    parse_window(window)
+    if report not in SHARDED_REPORTS:
+        raise ValueError(f"{report} cannot be sharded")
+    rows = [(report, target, window) for target in targets] + [(report, MERGE, window)]
+    conn.execute("BEGIN IMMEDIATE")
+    before = conn.total_changes
+    conn.executemany("INSERT OR IGNORE INTO tasks (report, target, window) VALUES (?, ?, ?)", rows)
+    added = conn.total_changes - before
+    conn.execute("COMMIT")
+    return added
+
+
+def claim(conn, owner):
+    """Lease the next runnable task to owner, or return None.
+
+    Runnable tasks are pending ones past their retry delay and leased ones
+    whose lease expired (their worker died). Shards come before merges; a
+    merge is only runnable once all its shards are done or failed. An
+    expired lease on a task that has used all its attempts (e.g. one that
+    keeps killing its worker) marks the task failed instead.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "UPDATE tasks SET status = 'failed', last_error = 'lease expired (worker died)', "
+            "lease_owner = NULL, lease_expires = NULL "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, WORK_MAX_ATTEMPTS),
+        )
+        row = conn.execute(
+            """
+            SELECT id, report, target, window FROM tasks AS t
+            WHERE ((status = 'pending' AND available_at <= :now)
+                   OR (status = 'leased' AND lease_expires < :now))
+              AND (target != :merge OR NOT EXISTS (
+                  SELECT 1 FROM tasks AS s
+                  WHERE s.report = t.report AND s.window = t.window AND s.target != :merge
+                    AND s.status IN ('pending', 'leased')))
+            ORDER BY target = :merge, id
+            LIMIT 1
+            """,
+            {"now": now, "merge": MERGE},
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', attempts = attempts + 1, lease_owner = ?, lease_expires = ? "
+                "WHERE id = ?",
+                (owner, now + WORK_LEASE_SECONDS, row[0]),
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+
+def renew(conn, task_id, owner):
+    """Extend owner's lease; False if the lease was lost to another worker."""
+    cursor = conn.execute(
+        "UPDATE tasks SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+        (time.time() + WORK_LEASE_SECONDS, task_id, owner),
+    )
+    return cursor.rowcount == 1
+
+
+def complete(conn, task_id, owner, result=None):
+    """Store a task's result; ignored if the lease was lost, so a reclaimed task is not recorded twice."""
+    conn.execute(
+        "UPDATE tasks SET status = 'done', result = ?, lease_owner = NULL, lease_expires = NULL "
+        "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+        (result, task_id, owner),
+    )
+
+
+def fail(conn, task_id, owner, error):
+    """Put a task back with exponential backoff, or mark it failed after WORK_MAX_ATTEMPTS."""
+    (attempts,) = conn.execute("SELECT attempts FROM tasks WHERE id = ?", (task_id,)).fetchone()
+    status = "failed" if attempts >= WORK_MAX_ATTEMPTS else "pending"
+    delay = min(600, 15 * 2 ** (attempts - 1))
+    conn.execute(
+        "UPDATE tasks SET status = ?, available_at = ?, last_error = ?, lease_owner = NULL, lease_expires = NULL "
+        "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+        (status, time.time() + delay, str(error), task_id, owner),
+    )
+
+
+def report_module(report):
+    """Import a sharded report once per worker process."""
+    module = _reports.get(report)
+    if module is None:
+        module = _reports[report] = load_report(SHARDED_REPORTS[report], report)
+    return module
+
+
+def merge(conn, report, window):
+    """Write the report from the results of all of its completed shards."""
+    records = []
+    for target, status, result in conn.execute(
+        "SELECT target, status, result FROM tasks WHERE report = ? AND window = ? AND target != ? ORDER BY id",
+        (report, window, MERGE),
+    ):
+        if status == "done":
+            records.extend(_load_records(result))
+        else:
+            print(f"{report}: no data for {target}, the task {status}")
+    report_module(report).write_reports(records)
+
+
+def run_task(conn, owner, task):
+    task_id, report, target, window = task
+    stop = threading.Event()
+
+    # Heartbeat on its own connection, so long API calls do not lose the lease
+    def heartbeat():
+        heartbeat_conn = connect()
+        try:
+            while not stop.wait(WORK_LEASE_SECONDS / 3):
+                if not renew(heartbeat_conn, task_id, owner):
+                    return
+        finally:
+            heartbeat_conn.close()
+
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        if target == MERGE:
+            merge(conn, report, window)
+            complete(conn, task_id, owner)
+        else:
+            start, end = parse_window(window)
+            records = report_module(report).get_cost_records(target, start, end)
+            complete(conn, task_id, owner, _dump_records(records))
+        print(f"[{owner}] {report} {target or 'merge'} done")
+    except Exception as e:
+        print(f"[{owner}] {report} {target or 'merge'} failed: {e}")
+        fail(conn, task_id, owner, e)
+    finally:
+        stop.set()
+        thread.join()
+
+
+def worker(wait=False):
+    """Claim and run tasks until the queue is drained (or forever with wait)."""
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    conn = connect()
+    try:
+        while True:
+            task = claim(conn, owner)
+            if task is not None:
+                run_task(conn, owner, task)
+                continue
+            (active,) = conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')"
+            ).fetchone()
+            if not active and not wait:
+                return
+            time.sleep(5)
+    finally:
+        conn.close()
+
+
+def run_workers(processes, wait=False):
+    """Run worker() in several processes, so JSON parsing and CSV writing use every core."""
+    workers = [multiprocessing.Process(target=worker, args=(wait,)) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+
+def print_status(conn):
+    for report, window, status, count in conn.execute(
+        "SELECT report, window, status, COUNT(*) FROM tasks GROUP BY report, window, status ORDER BY window, report"
+    ):
+        print(f"{window}\t{report}\t{status}\t{count}")
+    for report, target, attempts, error in conn.execute(
+        "SELECT report, target, attempts, last_error FROM tasks WHERE status = 'failed'"
+    ):
+        print(f"failed: {report} {target} after {attempts} attempts: {error}")
+
+
+# Sharded execution for very large tenants, e.g.
+#   python work_queue.py enqueue azure_cost_per_service_per_account
+#   python work_queue.py work --processes 8        (on every host sharing the queue)
+#   python work_queue.py status
+def main():
+    parser = argparse.ArgumentParser(description="Sharded report execution over a shared SQLite work queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue_parser = commands.add_parser("enqueue", help="queue one task per subscription")
+    enqueue_parser.add_argument("reports", nargs="+", choices=sorted(SHARDED_REPORTS))
+    enqueue_parser.add_argument("--targets", help="comma separated subscription IDs (default: AZURE_SUBSCRIPTION_ID)")
+    enqueue_parser.add_argument("--start", type=datetime.fromisoformat, help="window start (default: 7 days before --end)")
+    enqueue_parser.add_argument("--end", type=datetime.fromisoformat, help="window end (default: the current hour, UTC)")
+    work_parser = commands.add_parser("work", help="run worker processes")
+    work_parser.add_argument("--processes", type=int, default=os.cpu_count())
+    work_parser.add_argument("--wait", action="store_true", help="keep polling when the queue is empty")
+    commands.add_parser("status")
+    args = parser.parse_args()
+
+    if args.command == "work":
+        run_workers(args.processes, args.wait)
+        return
+
+    conn = connect()
+    try:
+        if args.command == "enqueue":
+            targets = [t.strip() for t in (args.targets or os.getenv("AZURE_SUBSCRIPTION_ID", "")).split(",") if t.strip()]
+            if args.start or args.end:
+                end = args.end or datetime.now(timezone.utc)
+                window = make_window(args.start or end - timedelta(days=7), end)
+            else:
+                window = default_window()
+            for report in args.reports:
+                print(f"{report}: {enqueue(conn, report, targets, window)} tasks queued for {window}")
+        else:
+            print_status(conn)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())